@@ -2,9 +2,9 @@
 
 from __future__ import annotations
 
-import random
 from functools import lru_cache
-from typing import List
+from itertools import count
+from typing import FrozenSet, List, Tuple
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -32,6 +32,15 @@ class Settings(BaseSettings):
     headless: bool = Field(default=True, alias="HEADLESS")
     request_delay_ms: int = Field(default=1200, alias="REQUEST_DELAY_MS", ge=0)
     max_concurrency: int = Field(default=3, alias="MAX_CONCURRENCY", ge=1)
+    blocked_resource_types_raw: str = Field(
+        default="image,font,media", alias="BLOCKED_RESOURCE_TYPES"
+    )
+    blocked_url_patterns_raw: str = Field(
+        default="*google-analytics.com*,*googletagmanager.com*,*mc.yandex.ru*",
+        alias="BLOCKED_URL_PATTERNS",
+    )
+    capture_category_html: bool = Field(default=False, alias="CAPTURE_CATEGORY_HTML")
+    capture_product_html: bool = Field(default=False, alias="CAPTURE_PRODUCT_HTML")
 
     use_proxy: bool = Field(default=False, alias="USE_PROXY")
     http_proxy: str = Field(default="", alias="HTTP_PROXY")
@@ -39,12 +48,16 @@ class Settings(BaseSettings):
 
     openai_api_key: str | None = Field(default=None, alias="OPENAI_API_KEY")
     llm_model: str = Field(default="gpt-4o-mini", alias="LLM_MODEL")
+    llm_max_concurrency: int = Field(default=5, alias="LLM_MAX_CONCURRENCY", ge=1)
+    llm_cache_path: str = Field(default="state/llm_cache.db", alias="LLM_CACHE_PATH")
 
     navigation_timeout_ms: int = Field(
         default=20_000, alias="NAVIGATION_TIMEOUT_MS", ge=1_000
     )
     max_retries: int = Field(default=3, alias="MAX_RETRIES", ge=0)
     state_db_path: str = Field(default="state/pipeline.db", alias="STATE_DB_PATH")
+    skip_unchanged_urls: bool = Field(default=True, alias="SKIP_UNCHANGED_URLS")
+    force_refresh_days: int = Field(default=1, alias="FORCE_REFRESH_DAYS", ge=0)
 
     freeimage_api_key: str = Field(default="", alias="FREEIMAGE_API_KEY")
     freeimage_api_endpoint: str = Field(
@@ -59,6 +72,7 @@ class Settings(BaseSettings):
     freeimage_max_retries: int = Field(
         default=3, alias="FREEIMAGE_MAX_RETRIES", ge=0
     )
+    media_concurrency: int = Field(default=4, alias="MEDIA_CONCURRENCY", ge=1)
 
     @property
     def request_delay_seconds(self) -> float:
@@ -66,8 +80,24 @@ class Settings(BaseSettings):
         return self.request_delay_ms / 1000.0
 
     def choice_user_agent(self) -> str:
-        """Вернуть случайный User-Agent из пула."""
-        return random.choice(USER_AGENT_POOL)
+        """Вернуть следующий User-Agent из пула (по кругу)."""
+        return USER_AGENT_POOL[next(_UA_COUNTER) % len(USER_AGENT_POOL)]
+
+    def blocked_resource_types(self) -> FrozenSet[str]:
+        """Типы ресурсов Playwright, которые краулер не загружает."""
+        return frozenset(
+            item.strip().lower()
+            for item in self.blocked_resource_types_raw.split(",")
+            if item.strip()
+        )
+
+    def blocked_url_patterns(self) -> List[str]:
+        """Шаблоны URL (трекеры и т.п.), блокируемые браузером на странице краулера."""
+        return [
+            item.strip()
+            for item in self.blocked_url_patterns_raw.split(",")
+            if item.strip()
+        ]
 
     def category_urls(self) -> List[str]:
         """Список стартовых URL категорий (из CATEGORY_URLS или одиночного CATEGORY_URL)."""
@@ -88,13 +118,13 @@ class Settings(BaseSettings):
         return [self.category_url]
 
 
-@lru_cache(maxsize=1)
+@lru_cache(maxsize=None)
 def get_settings() -> Settings:
     """Получить кешированный экземпляр настроек."""
     return Settings()  # type: ignore[call-arg]
 
 
-USER_AGENT_POOL: List[str] = [
+USER_AGENT_POOL: Tuple[str, ...] = (
     (
         "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_3) AppleWebKit/537.36 "
         "(KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
@@ -115,4 +145,7 @@ USER_AGENT_POOL: List[str] = [
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:122.0) "
         "Gecko/20100101 Firefox/122.0"
     ),
-]
+)
+
+# Счётчик для ротации User-Agent без обращения к глобальному random.
+_UA_COUNTER = count()
@@ -2,24 +2,74 @@
 
 from __future__ import annotations
 
-from collections import deque
 import logging
 from dataclasses import dataclass
-from typing import AsyncIterator, Deque, List, Optional, Set
-from urllib.parse import parse_qs, urljoin, urlparse
+from functools import lru_cache
+from itertools import islice
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
 
-from playwright.async_api import BrowserContext, Page
+from playwright.async_api import BrowserContext, Page, Route
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 
 from app.config import Settings
 from app.models import CategoryPageResult, ProductLink
 from app.playwright_helpers import close_age_confirmation
+from app.utils import RequestThrottle
 
 PRODUCT_LINK_SELECTOR = "a[href^='/katalog/tovar/']"
 PAGINATION_LINK_SELECTOR = "a[href*='PAGEN_1=']"
+# Абсолютные URL (el.href) и дедупликация считаются в браузере за один вызов;
+# позиция — порядковый номер ссылки среди всех найденных элементов.
+COLLECT_PRODUCT_LINKS_JS = """
+elements => {
+    const seen = new Set();
+    const links = [];
+    const duplicates = [];
+    elements.forEach((el, index) => {
+        const url = el.href;
+        if (!url) return;
+        if (seen.has(url)) {
+            duplicates.push(url);
+            return;
+        }
+        seen.add(url);
+        links.push([url, index + 1]);
+    });
+    return {links, duplicates};
+}
+"""
+COLLECT_UNIQUE_HREFS_JS = """
+elements => {
+    const seen = new Set();
+    for (const el of elements) {
+        if (el.href) seen.add(el.href);
+    }
+    return Array.from(seen);
+}
+"""
+# Короткое ожидание сетевой тишины, если пагинация дорисовывается скриптами.
+NETWORK_IDLE_GRACE_MS = 5_000
 
 LOGGER = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=1024)
+def _extract_page_number(url: str) -> Optional[int]:
+    """Получить номер страницы из URL по параметру PAGEN_1."""
+    parsed = urlparse(url)
+    values = parse_qs(parsed.query).get("PAGEN_1")
+    if not values:
+        if parsed.path.rstrip("/").endswith("drinktype-konyak"):
+            return 1
+        return None
+    try:
+        return int(values[0])
+    except (ValueError, TypeError):
+        return None
+
+
 @dataclass(slots=True)
 class CategoryCrawlerMetrics:
     """Показатели работы краулера."""
@@ -32,59 +82,74 @@ class CategoryCrawlerMetrics:
 class CategoryCrawler:
     """Обходит страницы категории и возвращает найденные карточки."""
 
-    def __init__(self, settings: Settings) -> None:
+    def __init__(
+        self, settings: Settings, throttle: Optional[RequestThrottle] = None
+    ) -> None:
         self._settings = settings
+        self._throttle = throttle or RequestThrottle(settings.request_delay_seconds)
         self.metrics = CategoryCrawlerMetrics()
         self._unique_product_urls: Set[str] = set()
         self._start_urls = settings.category_urls()
+        self._blocked_resource_types = settings.blocked_resource_types()
+        self._blocked_url_patterns = settings.blocked_url_patterns()
+        # Без CSS видимость модалки 18+ недостоверна: подтверждение на такой
+        # странице не должно отключать проверку во вкладках парсера.
+        self._css_loaded = "stylesheet" not in self._blocked_resource_types
 
     async def crawl(self, context: BrowserContext) -> AsyncIterator[CategoryPageResult]:
         """Асинхронно обойти все доступные страницы и вернуть результаты."""
         page = await context.new_page()
+        if self._blocked_resource_types:
+            # Листингу не нужны картинки/шрифты — блокируем только на странице
+            # краулера, у вкладок парсера карточек свой, более мягкий фильтр.
+            await page.route("**/*", self._block_resources)
+        await self._block_url_patterns(context, page)
         visited: Set[str] = set()
-        queued: Set[str] = set()
-        queue: Deque[str] = deque()
-        for url in self._start_urls:
-            queue.append(url)
-            queued.add(url)
+        # dict сохраняет порядок вставки: работает как FIFO-очередь с O(1) проверкой.
+        queue: Dict[str, None] = dict.fromkeys(self._start_urls)
         fallback_page_counter = 0
 
         try:
             while queue:
-                target_url = queue.popleft()
-                queued.discard(target_url)
+                target_url = next(iter(queue))
+                del queue[target_url]
 
                 if target_url in visited:
                     continue
 
+                await self._throttle.wait()
                 LOGGER.info("Краулер: переход на страницу %s", target_url)
                 await page.goto(
                     target_url,
-                    wait_until="networkidle",
+                    wait_until="domcontentloaded",
                     timeout=self._settings.navigation_timeout_ms,
                 )
-                await close_age_confirmation(page)
+                await close_age_confirmation(page, remember=self._css_loaded)
                 await self._ensure_product_links_visible(page)
 
                 fallback_page_counter += 1
-                current_page_number = self._extract_page_number(
+                current_page_number = _extract_page_number(
                     page.url
                 ) or fallback_page_counter
 
                 product_links = await self._collect_product_links(
                     page, current_page_number
                 )
-                raw_html = await page.content()
+                # Полный DOM листинга никому ниже по пайплайну не нужен —
+                # сериализуем его только по явному флагу (для отладки).
+                raw_html = (
+                    await page.content()
+                    if self._settings.capture_category_html
+                    else ""
+                )
 
                 discovered_pages = await self._collect_pagination_links(
                     page, current_page_number
                 )
 
                 for new_page_url in discovered_pages:
-                    if new_page_url in visited or new_page_url in queued:
-                        continue
-                    queue.append(new_page_url)
-                    queued.add(new_page_url)
+                    if new_page_url not in visited:
+                        queue.setdefault(new_page_url)
 
                 visited.add(page.url)
                 self._update_metrics(product_links)
@@ -96,11 +161,30 @@ class CategoryCrawler:
                     discovered_page_urls=discovered_pages,
                     raw_html=raw_html,
                 )
-
-                await page.wait_for_timeout(self._settings.request_delay_ms)
         finally:
             await page.close()
 
+    async def _block_url_patterns(self, context: BrowserContext, page: Page) -> None:
+        """Заблокировать трекеры на уровне сети Chromium (без перехвата в Python)."""
+        if not self._blocked_url_patterns:
+            return
+        try:
+            cdp = await context.new_cdp_session(page)
+            await cdp.send("Network.enable")
+            await cdp.send(
+                "Network.setBlockedURLs", {"urls": self._blocked_url_patterns}
+            )
+        except PlaywrightError as exc:
+            # CDP доступен только в Chromium — в остальных браузерах просто не блокируем.
+            LOGGER.warning("Краулер: не удалось включить блокировку URL: %s", exc)
+
+    async def _block_resources(self, route: Route) -> None:
+        """Отклонить запросы к тяжёлым ресурсам, остальные пропустить."""
+        if route.request.resource_type in self._blocked_resource_types:
+            await route.abort()
+        else:
+            await route.continue_()
+
     async def _ensure_product_links_visible(self, page: Page) -> None:
         """Ожидать появления карточек товаров на странице."""
         await page.wait_for_selector(
@@ -114,37 +198,24 @@ class CategoryCrawler:
         page_number: Optional[int],
     ) -> List[ProductLink]:
         """Сохранить ссылки на карточки с учётом позиции."""
-        hrefs = await page.eval_on_selector_all(
-            PRODUCT_LINK_SELECTOR,
-            "elements => elements.map(el => el.getAttribute('href'))",
+        collected = await page.locator(PRODUCT_LINK_SELECTOR).evaluate_all(
+            COLLECT_PRODUCT_LINKS_JS
         )
-        links: List[ProductLink] = []
-        seen: Set[str] = set()
-        duplicates: List[str] = []
-
-        for position, raw_href in enumerate(hrefs, start=1):
-            if not raw_href:
-                continue
-            absolute_url = urljoin(page.url, raw_href)
-            if absolute_url in seen:
-                duplicates.append(absolute_url)
-                continue
-            seen.add(absolute_url)
-            links.append(
-                ProductLink(
-                    url=absolute_url,
-                    source_page_url=page.url,
-                    page_number=page_number,
-                    position=position,
-                )
-            )
+        page_url = page.url
+        # URL уже абсолютные (el.href), поэтому список строится одним выражением.
+        links = [
+            ProductLink(url, page_url, page_number, position)
+            for url, position in collected["links"]
+        ]
+        duplicates: List[str] = collected["duplicates"]
         duplicates_count = len(duplicates)
-        if duplicates_count:
-            sample = ", ".join(sorted(set(duplicates))[:3])
+        if duplicates_count and LOGGER.isEnabledFor(logging.INFO):
+            # Первые три различных дубликата в порядке появления, без сортировки.
+            sample = ", ".join(islice(dict.fromkeys(duplicates), 3))
             LOGGER.info(
                 "Краулер: на странице %s (%s) отфильтровано %s дубликатов, примеры: %s",
                 page_number if page_number is not None else "N/A",
-                page.url,
+                page_url,
                 duplicates_count,
                 sample,
             )
@@ -156,43 +227,30 @@ class CategoryCrawler:
         current_page: Optional[int],
     ) -> List[str]:
         """Собрать ссылки на следующие страницы."""
-        hrefs = await page.eval_on_selector_all(
-            PAGINATION_LINK_SELECTOR,
-            "elements => elements.map(el => el.href)",
+        hrefs = await page.locator(PAGINATION_LINK_SELECTOR).evaluate_all(
+            COLLECT_UNIQUE_HREFS_JS
         )
-        candidate_urls: List[str] = []
-        seen: Set[str] = set()
-
-        for raw_href in hrefs:
-            if not raw_href:
-                continue
-            absolute_url = urljoin(page.url, raw_href)
-            if absolute_url in seen:
-                continue
-            seen.add(absolute_url)
-            page_number = self._extract_page_number(absolute_url)
+        if not hrefs:
+            # Пагинация могла ещё не отрисоваться: ждём сеть недолго и пробуем снова.
+            try:
+                await page.wait_for_load_state(
+                    "networkidle", timeout=NETWORK_IDLE_GRACE_MS
+                )
+            except PlaywrightTimeoutError:
+                LOGGER.debug("Краулер: не дождались networkidle на %s", page.url)
+            hrefs = await page.locator(PAGINATION_LINK_SELECTOR).evaluate_all(
+                COLLECT_UNIQUE_HREFS_JS
+            )
+        candidates: List[Tuple[str, Optional[int]]] = []
+        for absolute_url in hrefs:
+            page_number = _extract_page_number(absolute_url)
             if current_page and page_number and page_number <= current_page:
                 continue
-            candidate_urls.append(absolute_url)
+            candidates.append((absolute_url, page_number))
 
-        candidate_urls.sort(
-            key=lambda url: self._extract_page_number(url) or float("inf")
-        )
-        return candidate_urls
-
-    def _extract_page_number(self, url: str) -> Optional[int]:
-        """Получить номер страницы из URL по параметру PAGEN_1."""
-        parsed = urlparse(url)
-        query = parse_qs(parsed.query)
-        values = query.get("PAGEN_1")
-        if not values:
-            if parsed.path.rstrip("/").endswith("drinktype-konyak"):
-                return 1
-            return None
-        try:
-            return int(values[0])
-        except (ValueError, TypeError):
-            return None
+        # Номер страницы уже посчитан — сортируем по нему без повторного разбора URL.
+        candidates.sort(key=lambda item: item[1] or float("inf"))
+        return [url for url, _ in candidates]
 
     def _update_metrics(self, product_links: List[ProductLink]) -> None:
         """Обновить счётчики по результатам страницы."""
@@ -1,5 +1,5 @@
 """Утилиты для работы с LLM."""
 
-from .client import LLMClient, LLMUnavailableError
+from .client import LLMClient, LLMUnavailableError, close_openai_clients
 
-__all__ = ["LLMClient", "LLMUnavailableError"]
+__all__ = ["LLMClient", "LLMUnavailableError", "close_openai_clients"]
@@ -2,21 +2,49 @@
 
 from __future__ import annotations
 
-import json
+import asyncio
+import hashlib
 import logging
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
 from typing import Any, Dict, Optional
 
+import orjson
 from openai import AsyncOpenAI, OpenAIError
 
 from app.config import Settings
 
 LOGGER = logging.getLogger(__name__)
 
+# Сколько разобранных ответов держим в памяти поверх дискового кеша.
+LLM_MEMORY_CACHE_SIZE = 4096
+
 
 class LLMUnavailableError(RuntimeError):
     """Генерируется при недоступности LLM (нет ключа или ошибка запроса)."""
 
 
+# Один AsyncOpenAI на ключ в пределах процесса: общий пул соединений httpx.
+_OPENAI_CLIENTS: Dict[str, AsyncOpenAI] = {}
+
+
+def _get_openai_client(api_key: str) -> AsyncOpenAI:
+    client = _OPENAI_CLIENTS.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key)
+        _OPENAI_CLIENTS[api_key] = client
+    return client
+
+
+async def close_openai_clients() -> None:
+    """Закрыть общие клиенты OpenAI при завершении пайплайна."""
+    clients = list(_OPENAI_CLIENTS.values())
+    _OPENAI_CLIENTS.clear()
+    for client in clients:
+        await client.close()
+
+
 class LLMClient:
     """Простая обёртка над OpenAI для нормализации данных."""
 
@@ -25,12 +53,24 @@ class LLMClient:
         self._enabled = bool(settings.openai_api_key)
         self._model = settings.llm_model
         self._client: Optional[AsyncOpenAI] = None
+        self._memory_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._disk_cache: Optional[sqlite3.Connection] = None
+        # Ограничение одновременных запросов к OpenAI (rate limits).
+        self._semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
 
         if self._enabled:
-            self._client = AsyncOpenAI(api_key=settings.openai_api_key)
+            self._client = _get_openai_client(settings.openai_api_key)
+            if settings.llm_cache_path:
+                self._disk_cache = self._open_disk_cache(settings.llm_cache_path)
         else:
             LOGGER.info("LLM отключён: отсутствует OPENAI_API_KEY")
 
+    def close(self) -> None:
+        """Закрыть дисковый кеш ответов (общий AsyncOpenAI закрывает close_openai_clients)."""
+        if self._disk_cache is not None:
+            self._disk_cache.close()
+            self._disk_cache = None
+
     async def normalize_price(self, text: str) -> Dict[str, Any]:
         """Привести строку цены к структуре JSON."""
         prompt = (
@@ -59,18 +99,25 @@ class LLMClient:
     async def _ask_json(self, prompt: str) -> Dict[str, Any]:
         if not self._enabled or not self._client:
             raise LLMUnavailableError("LLM disabled or not configured")
+        cache_key = self._cache_key(prompt)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
         try:
-            response = await self._client.chat.completions.create(
-                model=self._model,
-                temperature=0,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Отвечай строго валидным JSON без пояснений.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-            )
+            async with self._semaphore:
+                response = await self._client.chat.completions.create(
+                    model=self._model,
+                    temperature=0,
+                    # JSON-режим гарантирует валидный объект без ```-обёрток.
+                    response_format={"type": "json_object"},
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "Отвечай строго валидным JSON без пояснений.",
+                        },
+                        {"role": "user", "content": prompt},
+                    ],
+                )
         except OpenAIError as exc:
             LOGGER.warning("LLM запрос завершился ошибкой: %s", exc)
             raise LLMUnavailableError(str(exc)) from exc
@@ -84,6 +131,74 @@ class LLMClient:
             raise LLMUnavailableError("LLM вернул пустой ответ")
 
         try:
-            return json.loads(content)
-        except json.JSONDecodeError as exc:
+            payload = orjson.loads(content)
+        except orjson.JSONDecodeError as exc:
             raise LLMUnavailableError("Невозможно распарсить JSON от LLM") from exc
+        # Кешируем только успешно разобранные ответы.
+        self._cache_put(cache_key, content, payload)
+        return payload
+
+    def _cache_key(self, prompt: str) -> str:
+        return hashlib.sha256(
+            f"{self._model}\n{prompt}".encode("utf-8"), usedforsecurity=False
+        ).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        payload = self._memory_cache.get(key)
+        if payload is not None:
+            self._memory_cache.move_to_end(key)
+            return payload
+        if self._disk_cache is None:
+            return None
+        row = self._disk_cache.execute(
+            "SELECT content FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            payload = orjson.loads(row[0])
+        except orjson.JSONDecodeError:
+            return None
+        self._remember(key, payload)
+        return payload
+
+    def _cache_put(self, key: str, content: str, payload: Dict[str, Any]) -> None:
+        self._remember(key, payload)
+        if self._disk_cache is None:
+            return
+        try:
+            with self._disk_cache:
+                self._disk_cache.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, content) "
+                    "VALUES (?, ?, ?)",
+                    (key, self._model, content),
+                )
+        except sqlite3.Error as exc:
+            LOGGER.warning("Не удалось сохранить ответ LLM в кеш: %s", exc)
+
+    def _remember(self, key: str, payload: Dict[str, Any]) -> None:
+        self._memory_cache[key] = payload
+        self._memory_cache.move_to_end(key)
+        if len(self._memory_cache) > LLM_MEMORY_CACHE_SIZE:
+            self._memory_cache.popitem(last=False)
+
+    def _open_disk_cache(self, path: str) -> Optional[sqlite3.Connection]:
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        key TEXT PRIMARY KEY,
+                        model TEXT,
+                        content TEXT NOT NULL
+                    )
+                    """
+                )
+        except (OSError, sqlite3.Error) as exc:
+            LOGGER.warning("Кеш LLM на диске недоступен (%s): %s", path, exc)
+            return None
+        return conn
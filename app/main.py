@@ -5,38 +5,54 @@ from __future__ import annotations
 import asyncio
 import logging
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, Dict, List, Optional
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter
+from typing import AsyncIterator, Dict, List, Mapping, Optional, Tuple
 
 from playwright.async_api import BrowserContext, async_playwright
 
 from app.config import Settings, get_settings
 from app.crawler import CategoryCrawler
+from app.llm import close_openai_clients
 from app.media import MediaUploader, MediaUploadResult
-from app.models import ProductNormalized
+from app.models import ProductLink, ProductNormalized
 from app.normalizer import ProductNormalizer
 from app.parser import ProductPageParser
 from app.sheets import SheetsWriter
-from app.state import StateRepository
-from app.utils import product_etag
+from app.state import ImageRecord, ProductRecord, StateRepository
+from app.utils import RequestThrottle, product_etag
 
 LOGGER = logging.getLogger(__name__)
 
 
+@dataclass(slots=True)
+class _ProductUpdate:
+    """Карточка с изменившимся etag, ожидающая изображения и записи в Sheets."""
+
+    product: ProductNormalized
+    position: int
+    product_id: str
+    etag_hash: str
+    image_sha256: Optional[str]
+    is_new: bool
+
+
 async def run() -> List[ProductNormalized]:
     """Запустить пайплайн сбора карточек и вернуть нормализованные данные."""
     settings = get_settings()
     configure_logging()
 
-    crawler = CategoryCrawler(settings)
-    parser = ProductPageParser(settings)
+    # Общий лимит частоты запросов к сайту вместо фиксированных пауз в каждом модуле.
+    throttle = RequestThrottle(settings.request_delay_seconds)
+    crawler = CategoryCrawler(settings, throttle)
+    parser = ProductPageParser(settings, throttle)
     normalizer = ProductNormalizer(settings)
     state = StateRepository(settings.state_db_path)
     media_uploader = MediaUploader(settings, state)
     sheets_writer = SheetsWriter(settings, state)
 
     normalized_products: List[ProductNormalized] = []
-    inserted = 0
-    updated = 0
     skipped = 0
     last_position = await sheets_writer.get_last_position()
     current_position = 0
@@ -45,7 +61,198 @@ async def run() -> List[ProductNormalized]:
         last_position + 1,
     )
 
+    semaphore = asyncio.Semaphore(settings.max_concurrency)
+    # Состояние карточек, чьи строки ещё в буфере SheetsWriter: сохраняем его
+    # только после успешного flush, иначе при сбое карточка не повторится.
+    # Вместе с записью храним исходный URL изображения, чей SHA-256 ещё считается.
+    pending_state: Dict[str, Tuple[ProductRecord, Optional[str]]] = {}
+
+    def save_product_state(
+        record: ProductRecord, hashing_image_url: Optional[str]
+    ) -> None:
+        """Сохранить состояние карточки, дописав SHA-256 фоновой загрузки."""
+        image_sha = record.image_sha256
+        if image_sha is None and hashing_image_url:
+            # Если фоновый хэш уже готов — он есть в state по исходному URL;
+            # иначе MediaUploader допишет его карточке сам по завершении.
+            cached_image = state.get_image_by_original(hashing_image_url)
+            image_sha = cached_image.sha256 if cached_image else None
+        state.upsert_product(
+            product_url=record.product_url,
+            product_id=record.product_id,
+            etag_hash=record.etag_hash,
+            image_sha256=image_sha,
+        )
+
+    def persist_flushed_state() -> None:
+        """Сохранить состояние карточек, строки которых уже отправлены в Sheets."""
+        for product_url in list(pending_state):
+            if sheets_writer.has_pending(product_url):
+                continue
+            save_product_state(*pending_state.pop(product_url))
+
     async with _launch_browser(settings) as context:
+
+        async def process_product(
+            product_link: ProductLink,
+            position: int,
+            updates: List[_ProductUpdate],
+        ) -> Optional[ProductNormalized]:
+            """Обработать одну карточку: парсинг, нормализация и проверка etag.
+
+            Карточки с изменившимся etag попадают в ``updates`` — изображения
+            и запись в Sheets для них выполняются после обработки всей страницы.
+            """
+            nonlocal skipped
+            # Дешёвая проверка по состоянию до навигации и LLM.
+            if _is_recently_processed(state.get_product(product_link.url), settings):
+                LOGGER.info(
+                    "Пропуск карточки %s (позиция %s): обработана менее %s дн. назад",
+                    product_link.url,
+                    position,
+                    settings.force_refresh_days,
+                )
+                skipped += 1
+                return None
+            async with semaphore:
+                LOGGER.info(
+                    "Начата обработка карточки: %s (страница %s, позиция %s)",
+                    product_link.url,
+                    product_link.page_number,
+                    position,
+                )
+                product = await parser.parse(context, product_link)
+                LOGGER.info("Парсинг завершён: %s", product.product_url)
+                normalized = await normalizer.normalize(product)
+                LOGGER.info("Нормализация завершена: %s", normalized.product_url)
+
+            etag_hash = product_etag(normalized)
+            product_record = state.get_product(normalized.product_url)
+            product_id = normalized.product_id or normalized.product_url
+            image_sha = product_record.image_sha256 if product_record else None
+
+            if product_record is None or product_record.etag_hash != etag_hash:
+                LOGGER.info(
+                    "Карточка %s требует обновления (etag изменился или отсутствует)",
+                    normalized.product_url,
+                )
+                updates.append(
+                    _ProductUpdate(
+                        product=normalized,
+                        position=position,
+                        product_id=product_id,
+                        etag_hash=etag_hash,
+                        image_sha256=image_sha,
+                        is_new=product_record is None,
+                    )
+                )
+                return normalized
+
+            skipped += 1
+            state.upsert_product(
+                product_url=normalized.product_url,
+                product_id=product_id,
+                etag_hash=etag_hash,
+                image_sha256=image_sha,
+            )
+            LOGGER.info("Сохранено состояние для %s", normalized.product_url)
+            return normalized
+
+        async def write_product(
+            update: _ProductUpdate,
+            media_result: MediaUploadResult,
+            known_images: Mapping[str, ImageRecord],
+        ) -> None:
+            """Дополнить карточку данными изображения и поставить строку в Sheets."""
+            nonlocal skipped
+            normalized = update.product
+            # Итог по изображениям страницы пишет ensure_images; здесь — детали.
+            LOGGER.debug(
+                "Обработка изображения завершена для %s: sha=%s, direct_url=%s",
+                normalized.product_url,
+                media_result.sha256,
+                media_result.direct_url,
+            )
+            media_error = media_result.error
+            if media_result.direct_url:
+                # Новое изображение: старый SHA карточки к нему не относится.
+                image_sha = media_result.sha256
+                image_direct_url = media_result.direct_url
+                image_viewer_url = media_result.viewer_url
+                image_thumb_url = media_result.thumb_url
+            else:
+                image_sha = media_result.sha256 or update.image_sha256
+                cached_image = known_images.get(image_sha) if image_sha else None
+                image_direct_url = cached_image.direct_url if cached_image else None
+                image_viewer_url = cached_image.viewer_url if cached_image else None
+                image_thumb_url = cached_image.thumb_url if cached_image else None
+
+            normalized.image_direct_url = image_direct_url
+            normalized.image_viewer_url = image_viewer_url
+            normalized.image_thumb_url = image_thumb_url
+            normalized.image_sha256 = image_sha
+
+            target_status = "new" if update.is_new else "updated"
+            if not image_direct_url:
+                if media_error is None:
+                    media_error = (
+                        "FreeImage upload skipped (missing API key or "
+                        "empty response)."
+                    )
+                target_status = "error"
+            record = sheets_writer.build_record(
+                product_url=normalized.product_url,
+                title=normalized.title,
+                price_value=normalized.price_value,
+                country=normalized.country,
+                volume_l=normalized.volume_l,
+                abv_percent=normalized.abv_percent,
+                age_years=normalized.age_years,
+                brand=normalized.brand,
+                producer=normalized.producer,
+                tasting_notes=normalized.tasting_notes,
+                gastronomy=normalized.gastronomy,
+                grapes=normalized.grapes,
+                maturation=normalized.maturation,
+                gift_packaging=normalized.gift_packaging,
+                position=update.position,
+                image_direct_url=image_direct_url,
+                status=target_status,
+                error_msg=media_error,
+            )
+            status = await sheets_writer.upsert(record)
+            LOGGER.info(
+                "Запись в Google Sheets для %s завершена со статусом %s",
+                normalized.product_url,
+                status,
+            )
+            state_record = ProductRecord(
+                product_url=normalized.product_url,
+                product_id=update.product_id,
+                etag_hash=update.etag_hash,
+                image_sha256=image_sha,
+            )
+            # SHA-256 загрузки по URL считается в фоне (см. MediaUploader).
+            hashing_image_url = (
+                media_result.original_url
+                if image_sha is None and media_result.direct_url
+                else None
+            )
+            # new/updated считает SheetsWriter при отправке пачки.
+            if status == "queued":
+                pending_state[normalized.product_url] = (
+                    state_record,
+                    hashing_image_url,
+                )
+                LOGGER.info(
+                    "Состояние %s будет сохранено после отправки в Sheets",
+                    normalized.product_url,
+                )
+                return
+            skipped += 1
+            save_product_state(state_record, hashing_image_url)
+            LOGGER.info("Сохранено состояние для %s", normalized.product_url)
+
         try:
             async for category_page in crawler.crawl(context):
                 LOGGER.info(
@@ -53,6 +260,8 @@ async def run() -> List[ProductNormalized]:
                     category_page.page_number,
                     len(category_page.product_links),
                 )
+                tasks = []
+                updates: List[_ProductUpdate] = []
                 for product_link in category_page.product_links:
                     current_position += 1
                     if current_position <= last_position:
@@ -62,137 +271,53 @@ async def run() -> List[ProductNormalized]:
                             current_position,
                         )
                         continue
-                    LOGGER.info(
-                        "Начата обработка карточки: %s (страница %s, позиция %s)",
-                        product_link.url,
-                        product_link.page_number,
-                        current_position,
+                    # Позицию фиксируем в момент создания задачи.
+                    tasks.append(
+                        process_product(product_link, current_position, updates)
                     )
-                    product = await parser.parse(context, product_link)
-                    LOGGER.info("Парсинг завершён: %s", product.product_url)
-                    normalized = await normalizer.normalize(product)
-                    LOGGER.info("Нормализация завершена: %s", normalized.product_url)
-                    normalized_products.append(normalized)
-
-                    etag_hash = product_etag(normalized)
-                    product_record = state.get_product(normalized.product_url)
-                    product_id = normalized.product_id or normalized.product_url
-
-                    need_update = (
-                        product_record is None
-                        or product_record.etag_hash != etag_hash
+                if not tasks:
+                    continue
+                # Дожидаемся всех задач страницы, затем пробрасываем первую ошибку,
+                # чтобы не оставлять «висящих» задач при закрытии браузера.
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, BaseException):
+                        raise result
+                normalized_products.extend(
+                    result for result in results if result is not None
+                )
+                if updates:
+                    # Строки в Sheets идут в порядке позиций, а не завершения задач.
+                    updates.sort(key=attrgetter("position"))
+                    # Изображения страницы — одной пачкой: общий запрос к state
+                    # и не более MEDIA_CONCURRENCY загрузок одновременно.
+                    media_results = await media_uploader.ensure_images(
+                        [update.product for update in updates]
                     )
-
-                    image_sha = product_record.image_sha256 if product_record else None
-                    image_direct_url: Optional[str] = None
-                    image_viewer_url: Optional[str] = None
-                    image_thumb_url: Optional[str] = None
-                    media_error: Optional[str] = None
-
-                    if need_update:
-                        LOGGER.info(
-                            "Карточка %s требует обновления (etag изменился или отсутствует)",
-                            normalized.product_url,
-                        )
-                        try:
-                            media_result = await media_uploader.ensure_image(normalized)
-                            LOGGER.info(
-                                "Обработка изображения завершена для %s: sha=%s, direct_url=%s",
-                                normalized.product_url,
-                                media_result.sha256,
-                                media_result.direct_url,
-                            )
-                        except Exception as exc:
-                            media_error = str(exc)
-                            LOGGER.exception(
-                                "Не удалось обработать изображение для %s: %s",
-                                normalized.product_url,
-                                exc,
-                            )
-                            media_result = MediaUploadResult(
-                                sha256=None,
-                                direct_url=None,
-                                viewer_url=None,
-                                thumb_url=None,
-                                original_url=normalized.hero_image_url,
-                                uploaded=False,
-                                cached=False,
-                            )
-
-                        if media_result.sha256:
-                            image_sha = media_result.sha256
-                            cached_image = state.get_image(media_result.sha256)
-                        else:
-                            cached_image = (
-                                state.get_image(image_sha) if image_sha else None
-                            )
-                        if media_result.direct_url:
-                            image_direct_url = media_result.direct_url
-                            image_viewer_url = media_result.viewer_url
-                            image_thumb_url = media_result.thumb_url
-                        elif cached_image:
-                            image_direct_url = cached_image.direct_url
-                            image_viewer_url = cached_image.viewer_url
-                            image_thumb_url = cached_image.thumb_url
-
-                        normalized.image_direct_url = image_direct_url
-                        normalized.image_viewer_url = image_viewer_url
-                        normalized.image_thumb_url = image_thumb_url
-                        normalized.image_sha256 = image_sha
-
-                        target_status = "new" if product_record is None else "updated"
-                        if not image_direct_url:
-                            if media_error is None:
-                                media_error = (
-                                    "FreeImage upload skipped (missing API key or "
-                                    "empty response)."
-                                )
-                            target_status = "error"
-                        record = sheets_writer.build_record(
-                            product_url=normalized.product_url,
-                            title=normalized.title,
-                            price_value=normalized.price_value,
-                            country=normalized.country,
-                            volume_l=normalized.volume_l,
-                            abv_percent=normalized.abv_percent,
-                            age_years=normalized.age_years,
-                            brand=normalized.brand,
-                            producer=normalized.producer,
-                            tasting_notes=normalized.tasting_notes,
-                            gastronomy=normalized.gastronomy,
-                            grapes=normalized.grapes,
-                            maturation=normalized.maturation,
-                            gift_packaging=normalized.gift_packaging,
-                            position=current_position,
-                            image_direct_url=image_direct_url,
-                            status=target_status,
-                            error_msg=media_error,
-                        )
-                        status = await sheets_writer.upsert(record)
-                        LOGGER.info(
-                            "Запись в Google Sheets для %s завершена со статусом %s",
-                            normalized.product_url,
-                            status,
-                        )
-                        if status == "new":
-                            inserted += 1
-                        elif status == "updated":
-                            updated += 1
-                        else:
-                            skipped += 1
-                    else:
-                        skipped += 1
-
-                    state.upsert_product(
-                        product_url=normalized.product_url,
-                        product_id=product_id,
-                        etag_hash=etag_hash,
-                        image_sha256=image_sha,
+                    # Фолбэк на ранее загруженные изображения — одним запросом к state.
+                    known_images = state.get_images(
+                        result.sha256 or update.image_sha256
+                        for update, result in zip(updates, media_results)
+                        if not result.direct_url
+                        and (result.sha256 or update.image_sha256)
                     )
-                    LOGGER.info("Сохранено состояние для %s", normalized.product_url)
+                    for update, media_result in zip(updates, media_results):
+                        await write_product(update, media_result, known_images)
+                # Страница обработана — отправляем её строки одной пачкой.
+                await sheets_writer.flush()
+                persist_flushed_state()
         finally:
-            await media_uploader.aclose()
-            state.close()
+            try:
+                await sheets_writer.flush()
+            finally:
+                # Карточки, не попавшие в Sheets, останутся без состояния
+                # и будут обработаны заново при следующем запуске.
+                persist_flushed_state()
+                await parser.aclose()
+                await media_uploader.aclose()
+                await close_openai_clients()
+                normalizer.close()
+                state.close()
 
     LOGGER.info(
         "Crawler: %s страниц, %s уникальных карточек",
@@ -212,14 +337,31 @@ async def run() -> List[ProductNormalized]:
     )
     LOGGER.info(
         "Sheets: inserted=%s updated=%s skipped=%s",
-        inserted,
-        updated,
+        sheets_writer.metrics.rows_inserted,
+        sheets_writer.metrics.rows_updated,
         skipped,
     )
 
     return normalized_products
 
 
+def _is_recently_processed(
+    record: Optional[ProductRecord], settings: Settings
+) -> bool:
+    """Проверить, что карточка уже есть в состоянии и ещё не требует обновления."""
+    if not settings.skip_unchanged_urls or record is None or not record.updated_at:
+        return False
+    try:
+        updated_at = datetime.fromisoformat(record.updated_at)
+    except ValueError:
+        return False
+    if updated_at.tzinfo is None:
+        # Время без зоны (записи старых баз) считаем UTC.
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    age = datetime.now(timezone.utc) - updated_at
+    return age < timedelta(days=settings.force_refresh_days)
+
+
 def configure_logging() -> None:
     """Базовая настройка логирования."""
     logging.basicConfig(
@@ -3,20 +3,51 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import hashlib
-import json
-from dataclasses import dataclass
-from typing import Optional
-from urllib.parse import urlparse
+import random
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
 import httpx
 import logging
+import orjson
 
 from app.config import Settings
 from app.models import ProductNormalized
-from app.state import StateRepository
+from app.state import ImageRecord, StateRepository
 
 SUPPORTED_SCHEMES = {"http", "https"}
+# Статусы FreeImage, при которых повтор запроса бессмыслен.
+NON_RETRYABLE_STATUSES = frozenset({400, 401, 403, 404, 415})
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MIN_POOL_CONNECTIONS = 32
+KEEPALIVE_EXPIRY_SECONDS = 30.0
+
+T = TypeVar("T")
+
+
+@functools.lru_cache(maxsize=8192)
+def _scheme_ok(url: str) -> bool:
+    """Проверить, что URL с поддерживаемой схемой (без полного urlparse)."""
+    index = url.find("://")
+    return index > 0 and url[:index].lower() in SUPPORTED_SCHEMES
+
+
+# Хэш идентифицирует содержимое, а не защищает его: FIPS-ограничения не нужны.
+_new_sha256 = functools.partial(hashlib.sha256, usedforsecurity=False)
 
 
 @dataclass(slots=True)
@@ -30,6 +61,18 @@ class MediaUploadResult:
     original_url: Optional[str]
     uploaded: bool
     cached: bool
+    error: Optional[str] = None
+
+    @classmethod
+    def empty(
+        cls,
+        original_url: Optional[str],
+        *,
+        sha256: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> "MediaUploadResult":
+        """Результат без загруженного изображения (пропуск или ошибка)."""
+        return cls(sha256, None, None, None, original_url, False, False, error)
 
 
 class MediaUploader:
@@ -39,41 +82,122 @@ class MediaUploader:
         self._settings = settings
         self._state = state
         self._logger = logging.getLogger(__name__)
+        # Постоянная часть POST-запроса к FreeImage, собирается один раз.
+        self._base_payload: Mapping[str, str] = MappingProxyType(
+            {
+                "key": settings.freeimage_api_key,
+                "action": "upload",
+                "format": "json",
+            }
+        )
+        self._upload_enabled = bool(settings.freeimage_api_key)
+        if not self._upload_enabled:
+            self._logger.info(
+                "Загрузка изображений отключена: отсутствует FREEIMAGE_API_KEY"
+            )
+        self._inflight_by_url: Dict[str, "asyncio.Future[MediaUploadResult]"] = {}
+        self._inflight_by_sha: Dict[str, "asyncio.Future[Optional[dict]]"] = {}
+        # Загружены по URL, SHA-256 ещё считается в фоне.
+        self._pending_by_url: Dict[str, MediaUploadResult] = {}
+        # Карточки, получившие такой результат: SHA-256 допишем им после расчёта.
+        self._awaiting_sha: Dict[str, Set[str]] = {}
+        self._background_tasks: Set["asyncio.Task[None]"] = set()
         timeout = httpx.Timeout(
             connect=self._settings.freeimage_connect_timeout,
             read=self._settings.freeimage_read_timeout,
             write=self._settings.freeimage_read_timeout,
             pool=self._settings.freeimage_connect_timeout,
         )
+        concurrency = self._settings.media_concurrency
+        # Каждое изображение — до двух запросов подряд (загрузка + скачивание),
+        # поэтому пул вдвое больше числа параллельных задач; соединения держим
+        # открытыми, чтобы не платить за TLS-рукопожатие на каждый запрос.
+        limits = httpx.Limits(
+            max_connections=max(MIN_POOL_CONNECTIONS, concurrency * 2),
+            max_keepalive_connections=concurrency,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+        )
         self._http_client = httpx.AsyncClient(
+            http2=True,
             timeout=timeout,
-            headers={"User-Agent": settings.choice_user_agent()},
+            limits=limits,
+            event_hooks={"request": [self._rotate_user_agent]},
         )
 
+    async def _rotate_user_agent(self, request: httpx.Request) -> None:
+        # Новый User-Agent на каждый запрос, а не один на всё время жизни клиента.
+        request.headers["User-Agent"] = self._settings.choice_user_agent()
+
     async def aclose(self) -> None:
+        # Дожидаемся фонового хэширования, иначе SHA не попадёт в state.
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
         await self._http_client.aclose()
 
+    async def ensure_images(
+        self, products: Sequence[ProductNormalized]
+    ) -> List[MediaUploadResult]:
+        """Обработать изображения пачки карточек параллельно (порядок сохраняется)."""
+        semaphore = asyncio.Semaphore(self._settings.media_concurrency)
+        # Один запрос к state вместо поиска по каждому исходному URL.
+        preloaded = self._state.get_images_by_originals(
+            {product.hero_image_url for product in products if product.hero_image_url}
+        )
+
+        async def _bounded(product: ProductNormalized) -> MediaUploadResult:
+            async with semaphore:
+                return await self._ensure_image_with_cache(product, preloaded)
+
+        outcomes = await asyncio.gather(
+            *(_bounded(product) for product in products), return_exceptions=True
+        )
+        results: List[MediaUploadResult] = []
+        for product, outcome in zip(products, outcomes):
+            if isinstance(outcome, BaseException):
+                self._logger.warning(
+                    "Ошибка обработки изображения %s: %s",
+                    product.hero_image_url,
+                    outcome,
+                )
+                outcome = MediaUploadResult.empty(
+                    product.hero_image_url, error=str(outcome)
+                )
+            results.append(outcome)
+        # Итог пачки — один INFO вместо сообщений по каждой карточке (они в DEBUG).
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info(
+                "Изображения пачки обработаны: всего %s, загружено %s, "
+                "из кеша %s, без изображения %s",
+                len(results),
+                sum(1 for result in results if result.uploaded),
+                sum(1 for result in results if result.cached),
+                sum(1 for result in results if not result.direct_url),
+            )
+        return results
+
     async def ensure_image(self, product: ProductNormalized) -> MediaUploadResult:
         """Загрузить изображение и вернуть информацию о нём."""
+        return await self._ensure_image_with_cache(product, None)
+
+    async def _ensure_image_with_cache(
+        self,
+        product: ProductNormalized,
+        preloaded: Optional[Mapping[str, ImageRecord]],
+    ) -> MediaUploadResult:
         original_url = product.hero_image_url
-        if not original_url or not self._is_supported_scheme(original_url):
-            self._logger.info(
+        if not original_url or not _scheme_ok(original_url):
+            self._logger.debug(
                 "Изображение пропущено: неподдерживаемый URL %s", original_url
             )
-            return MediaUploadResult(
-                sha256=None,
-                direct_url=None,
-                viewer_url=None,
-                thumb_url=None,
-                original_url=original_url,
-                uploaded=False,
-                cached=False,
-            )
+            return MediaUploadResult.empty(original_url)
 
-        # Проверяем по оригинальному URL
-        cached_original = self._state.get_image_by_original(original_url)
+        # Проверяем по оригинальному URL (state учитывает загрузки, завершённые
+        # уже после предзагрузки пачки)
+        cached_original = preloaded.get(original_url) if preloaded else None
+        if cached_original is None:
+            cached_original = self._state.get_image_by_original(original_url)
         if cached_original:
-            self._logger.info(
+            self._logger.debug(
                 "Изображение взято из кеша по оригинальному URL: %s", original_url
             )
             return MediaUploadResult(
@@ -85,105 +209,127 @@ class MediaUploader:
                 uploaded=False,
                 cached=True,
             )
+        pending = self._pending_by_url.get(original_url)
+        if pending is not None:
+            self._await_sha(original_url, product.product_url)
+            return replace(pending, uploaded=False, cached=True)
+
+        # Одинаковый URL у нескольких карточек обрабатываем один раз
+        shared = original_url in self._inflight_by_url
+        result = await self._share_inflight(
+            self._inflight_by_url,
+            original_url,
+            lambda: self._upload_image(original_url),
+        )
+        if shared and result.uploaded:
+            # Загрузку выполнила другая карточка — для этой результат из кеша,
+            # чтобы сводка считала загрузки, а не карточки.
+            result = replace(result, uploaded=False, cached=True)
+        if result.sha256 is None and original_url in self._pending_by_url:
+            self._await_sha(original_url, product.product_url)
+        return result
 
+    def _await_sha(self, original_url: str, product_url: str) -> None:
+        self._awaiting_sha.setdefault(original_url, set()).add(product_url)
+
+    async def _share_inflight(
+        self,
+        registry: Dict[str, "asyncio.Future[T]"],
+        key: str,
+        factory: Callable[[], Awaitable[T]],
+    ) -> T:
+        """Выполнить работу один раз на ключ; параллельные вызовы ждут тот же результат."""
+        task = registry.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            registry[key] = task
+            task.add_done_callback(lambda _: registry.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общую задачу
+        return await asyncio.shield(task)
+
+    async def _upload_image(self, original_url: str) -> MediaUploadResult:
         # Пытаемся загрузить напрямую по URL
         upload_response = await self._upload_via_url(original_url)
-        image_bytes: Optional[bytes] = None
-        image_sha: Optional[str] = None
-
-        if upload_response is None:
-            self._logger.info(
-                "Не удалось загрузить изображение по URL, пробуем скачать: %s",
-                original_url,
-            )
-            # Фолбэк: скачиваем изображение и загружаем бинарно
-            image_bytes = await self._download(original_url)
-            if image_bytes is None:
-                self._logger.warning(
-                    "Не удалось скачать изображение для %s", original_url
-                )
-                return MediaUploadResult(
-                    sha256=None,
-                    direct_url=None,
-                    viewer_url=None,
-                    thumb_url=None,
-                    original_url=original_url,
-                    uploaded=False,
-                    cached=False,
-                )
-            image_sha = self._sha256(image_bytes)
-            cached = self._state.get_image(image_sha)
-            if cached:
-                self._logger.info(
-                    "Найдено изображение с тем же SHA-256, переиспользуем запись."
-                )
-                # Обновляем связь оригинального URL с уже загруженным изображением
-                self._state.save_image(
-                    sha256=image_sha,
-                    direct_url=cached.direct_url,
-                    viewer_url=cached.viewer_url,
-                    thumb_url=cached.thumb_url,
-                    original_url=original_url,
-                )
-                return MediaUploadResult(
-                    sha256=image_sha,
-                    direct_url=cached.direct_url,
-                    viewer_url=cached.viewer_url,
-                    thumb_url=cached.thumb_url,
-                    original_url=original_url,
-                    uploaded=False,
-                    cached=True,
-                )
-            upload_response = await self._upload_via_bytes(image_bytes)
-            if upload_response is None:
-                self._logger.warning(
-                    "Не удалось загрузить изображение бинарно для %s", original_url
-                )
-                return MediaUploadResult(
-                    sha256=image_sha,
-                    direct_url=None,
-                    viewer_url=None,
-                    thumb_url=None,
-                    original_url=original_url,
-                    uploaded=False,
-                    cached=False,
-                )
-        else:
-            self._logger.info(
+        if upload_response is not None:
+            self._logger.debug(
                 "Изображение успешно загружено по URL: %s", original_url
             )
-            # Загружено по URL — вычислим SHA по скачанному контенту (с direct_url или оригинала)
-            image_bytes = await self._download(upload_response["direct_url"])
-            if image_bytes is None:
-                self._logger.warning(
-                    "Не удалось скачать direct_url %s, пробуем оригинал %s",
-                    upload_response.get("direct_url"),
-                    original_url,
-                )
-                image_bytes = await self._download(original_url)
-            if image_bytes is not None:
-                image_sha = self._sha256(image_bytes)
-
-        direct_url = upload_response.get("direct_url")
-        viewer_url = upload_response.get("viewer_url")
-        thumb_url = upload_response.get("thumb_url")
-
-        if image_bytes is not None and image_sha is None:
-            image_sha = self._sha256(image_bytes)
+            result = MediaUploadResult(
+                sha256=None,
+                direct_url=upload_response.get("direct_url"),
+                viewer_url=upload_response.get("viewer_url"),
+                thumb_url=upload_response.get("thumb_url"),
+                original_url=original_url,
+                uploaded=True,
+                cached=False,
+            )
+            # SHA-256 считаем в фоне: карточке он не нужен для записи в таблицу,
+            # а повторное скачивание не должно задерживать пайплайн.
+            self._pending_by_url[original_url] = result
+            self._spawn(self._hash_uploaded(result))
+            return result
 
-        if image_sha:
+        self._logger.debug(
+            "Не удалось загрузить изображение по URL, пробуем скачать: %s",
+            original_url,
+        )
+        # Фолбэк: скачиваем изображение и загружаем бинарно
+        image_bytes, image_sha = await self._download_and_hash(
+            original_url, keep_bytes=True
+        )
+        if image_bytes is None or image_sha is None:
+            self._logger.warning(
+                "Не удалось скачать изображение для %s", original_url
+            )
+            return MediaUploadResult.empty(original_url)
+        cached = self._state.get_image(image_sha)
+        if cached:
+            self._logger.debug(
+                "Найдено изображение с тем же SHA-256, переиспользуем запись."
+            )
+            # Обновляем связь оригинального URL с уже загруженным изображением
             self._state.save_image(
                 sha256=image_sha,
-                direct_url=direct_url,
-                viewer_url=viewer_url,
-                thumb_url=thumb_url,
+                direct_url=cached.direct_url,
+                viewer_url=cached.viewer_url,
+                thumb_url=cached.thumb_url,
                 original_url=original_url,
             )
-            self._logger.info(
-                "Сохранена информация об изображении: sha=%s, direct_url=%s",
-                image_sha,
-                direct_url,
+            return MediaUploadResult(
+                sha256=image_sha,
+                direct_url=cached.direct_url,
+                viewer_url=cached.viewer_url,
+                thumb_url=cached.thumb_url,
+                original_url=original_url,
+                uploaded=False,
+                cached=True,
+            )
+        upload_response = await self._share_inflight(
+            self._inflight_by_sha,
+            image_sha,
+            lambda: self._upload_via_bytes(image_bytes),
+        )
+        if upload_response is None:
+            self._logger.warning(
+                "Не удалось загрузить изображение бинарно для %s", original_url
             )
+            return MediaUploadResult.empty(original_url, sha256=image_sha)
+
+        direct_url = upload_response.get("direct_url")
+        viewer_url = upload_response.get("viewer_url")
+        thumb_url = upload_response.get("thumb_url")
+        self._state.save_image(
+            sha256=image_sha,
+            direct_url=direct_url,
+            viewer_url=viewer_url,
+            thumb_url=thumb_url,
+            original_url=original_url,
+        )
+        self._logger.debug(
+            "Сохранена информация об изображении: sha=%s, direct_url=%s",
+            image_sha,
+            direct_url,
+        )
 
         return MediaUploadResult(
             sha256=image_sha,
@@ -195,40 +341,73 @@ class MediaUploader:
             cached=False,
         )
 
+    async def _hash_uploaded(self, result: MediaUploadResult) -> None:
+        """Посчитать SHA-256 изображения, загруженного по URL, и сохранить в state."""
+        original_url = result.original_url or ""
+        try:
+            _, image_sha = await self._download_and_hash(
+                result.direct_url or "", keep_bytes=False
+            )
+            if image_sha is None:
+                self._logger.warning(
+                    "Не удалось скачать direct_url %s, пробуем оригинал %s",
+                    result.direct_url,
+                    original_url,
+                )
+                _, image_sha = await self._download_and_hash(
+                    original_url, keep_bytes=False
+                )
+            if image_sha is None:
+                self._logger.warning(
+                    "Не удалось посчитать SHA-256 изображения %s", original_url
+                )
+                return
+            self._state.save_image(
+                sha256=image_sha,
+                direct_url=result.direct_url,
+                viewer_url=result.viewer_url,
+                thumb_url=result.thumb_url,
+                original_url=original_url,
+            )
+            self._logger.debug(
+                "Сохранена информация об изображении: sha=%s, direct_url=%s",
+                image_sha,
+                result.direct_url,
+            )
+            # Карточки уже могли сохраниться в state без SHA — дописываем его.
+            for product_url in self._awaiting_sha.get(original_url, ()):
+                self._state.set_product_image(product_url, image_sha)
+        finally:
+            self._pending_by_url.pop(original_url, None)
+            self._awaiting_sha.pop(original_url, None)
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
     async def _upload_via_url(self, image_url: str) -> Optional[dict]:
-        payload = {
-            "key": self._settings.freeimage_api_key,
-            "action": "upload",
-            "format": "json",
-            "source": image_url,
-        }
+        payload = {**self._base_payload, "source": image_url}
         return await self._post_to_freeimage(data=payload)
 
     async def _upload_via_bytes(self, image_bytes: bytes) -> Optional[dict]:
-        payload = {
-            "key": self._settings.freeimage_api_key,
-            "action": "upload",
-            "format": "json",
-        }
         files = {
             "source": ("image.jpg", image_bytes, "application/octet-stream"),
         }
-        return await self._post_to_freeimage(data=payload, files=files)
+        return await self._post_to_freeimage(data=self._base_payload, files=files)
 
     async def _post_to_freeimage(
         self,
         *,
-        data: dict,
+        data: Mapping[str, str],
         files: Optional[dict] = None,
     ) -> Optional[dict]:
-        if not self._settings.freeimage_api_key:
-            self._logger.info(
-                "Пропуск загрузки изображения: отсутствует FREEIMAGE_API_KEY"
-            )
+        if not self._upload_enabled:
             return None
 
         last_error: Optional[str] = None
-        for attempt in range(self._settings.freeimage_max_retries + 1):
+        max_attempts = self._settings.freeimage_max_retries + 1
+        for attempt in range(max_attempts):
             try:
                 self._logger.debug(
                     "Запрос к FreeImage (попытка %s): %s",
@@ -240,6 +419,28 @@ class MediaUploader:
                     data=data,
                     files=files,
                 )
+            except httpx.TransportError as exc:
+                last_error = str(exc)
+                self._logger.warning(
+                    "Ошибка запроса к FreeImage (попытка %s): %s",
+                    attempt + 1,
+                    exc,
+                )
+            except httpx.HTTPError as exc:
+                # Ошибки протокола/редиректов повтор не исправит.
+                last_error = str(exc)
+                self._logger.warning("Ошибка запроса к FreeImage: %s", exc)
+                break
+            else:
+                if response.status_code in NON_RETRYABLE_STATUSES:
+                    # Отказ по существу (например, hotlink по URL) — без повторов,
+                    # вызывающий код перейдёт к фолбэку.
+                    self._logger.warning(
+                        "FreeImage отклонил запрос со статусом %s: %s",
+                        response.status_code,
+                        response.text,
+                    )
+                    return None
                 json_payload = self._parse_response(response)
                 if json_payload is not None:
                     self._logger.debug("FreeImage ответ успешно распарсен")
@@ -250,15 +451,10 @@ class MediaUploader:
                     attempt + 1,
                     last_error,
                 )
-            except httpx.HTTPError as exc:
-                last_error = str(exc)
-                self._logger.warning(
-                    "Ошибка запроса к FreeImage (попытка %s): %s",
-                    attempt + 1,
-                    exc,
-                )
 
-            await asyncio.sleep(min(2 ** attempt, 5))
+            if attempt + 1 < max_attempts:
+                # Полный джиттер: параллельные загрузки не повторяют запросы синхронно.
+                await asyncio.sleep(random.uniform(0, min(2 ** attempt, 5)))
 
         if last_error:
             raise RuntimeError(
@@ -275,8 +471,8 @@ class MediaUploader:
             )
             return None
         try:
-            payload = response.json()
-        except json.JSONDecodeError:
+            payload = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
             self._logger.warning("FreeImage вернул не-JSON ответ: %s", response.text)
             return None
         success = payload.get("success") or {}
@@ -300,19 +496,26 @@ class MediaUploader:
             "thumb_url": (image_info.get("thumb") or {}).get("url"),
         }
 
-    async def _download(self, url: str) -> Optional[bytes]:
-        if not url or not self._is_supported_scheme(url):
-            return None
+    async def _download_and_hash(
+        self, url: str, keep_bytes: bool
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        """Скачать файл потоком, считая SHA-256 по чанкам.
+
+        Байты накапливаются только при ``keep_bytes=True`` (для бинарной загрузки).
+        """
+        if not url or not _scheme_ok(url):
+            return None, None
+        hasher = _new_sha256()
+        buffer = bytearray() if keep_bytes else None
         try:
-            response = await self._http_client.get(url, follow_redirects=True)
-            response.raise_for_status()
-            return response.content
+            async with self._http_client.stream(
+                "GET", url, follow_redirects=True
+            ) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    if buffer is not None:
+                        buffer.extend(chunk)
         except httpx.HTTPError:
-            return None
-
-    def _sha256(self, data: bytes) -> str:
-        return hashlib.sha256(data).hexdigest()
-
-    def _is_supported_scheme(self, url: str) -> bool:
-        parsed = urlparse(url)
-        return parsed.scheme.lower() in SUPPORTED_SCHEMES
+            return None, None
+        return (bytes(buffer) if buffer is not None else None), hasher.hexdigest()
@@ -6,7 +6,7 @@ from dataclasses import dataclass, field
 from typing import Dict, List, Optional
 
 
-@dataclass(slots=True)
+@dataclass(slots=True, frozen=True)
 class ProductLink:
     """Описание ссылки на карточку товара, найденной на странице категории."""
 
@@ -16,7 +16,7 @@ class ProductLink:
     position: int
 
 
-@dataclass(slots=True)
+@dataclass(slots=True, frozen=True)
 class CategoryPageResult:
     """Результат обхода одной страницы категории."""
 
@@ -78,7 +78,10 @@ class ProductRaw:
 
 @dataclass(slots=True)
 class ProductNormalized:
-    """Нормализованные данные карточки, готовые к выгрузке."""
+    """Нормализованные данные карточки, готовые к выгрузке.
+
+    Не заморожен: поля `image_*` заполняются в `main` после загрузки изображения.
+    """
 
     product_url: str
     source_page_url: str
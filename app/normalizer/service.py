@@ -2,9 +2,13 @@
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import logging
 import re
+import time
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, Optional, Tuple
 
 from app.config import Settings
@@ -14,9 +18,34 @@ from app.utils import clean_text, extract_abv_percent, extract_float_with_unit,
 
 LOGGER = logging.getLogger(__name__)
 
+SECTION_FIELDS = (
+    "tasting_notes",
+    "gastronomy",
+    "grapes",
+    "maturation",
+    "awards",
+    "producer",
+    "gift_packaging",
+)
+
 AGE_REGEX = re.compile(r"(\d{1,3})\s*(?:yo|y\.o\.|год(?:а|ов)?|лет)", re.IGNORECASE)
 
 
+# Сколько секунд не повторяем запрос к LLM, который только что завершился ошибкой.
+LLM_FAILURE_TTL_SECONDS = 300.0
+
+
+def _llm_request_key(mode: str, data: object) -> str:
+    return hashlib.blake2b(
+        f"{mode}|{data!r}".encode("utf-8"), digest_size=16, usedforsecurity=False
+    ).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _sha256_hex(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8"), usedforsecurity=False).hexdigest()
+
+
 def raw_value_preview(data: object, max_length: int = 60) -> str:
     """Подготовить укороченное представление значения для логов."""
     text = str(data)
@@ -41,18 +70,36 @@ class ProductNormalizer:
         self._llm_client = llm_client or (
             LLMClient(settings) if settings.openai_api_key else None
         )
+        # Без клиента LLM фолбэки пропускаются сразу, без лишних await.
+        self._llm_enabled = self._llm_client is not None
         self.metrics = NormalizerMetrics()
+        self._llm_inflight: Dict[str, "asyncio.Future[Optional[Dict[str, object]]]"] = {}
+        self._llm_failed_at: Dict[str, float] = {}
+
+    def close(self) -> None:
+        """Освободить ресурсы LLM-клиента (дисковый кеш ответов)."""
+        if self._llm_client is not None:
+            self._llm_client.close()
 
     async def normalize(self, raw: ProductRaw) -> ProductNormalized:
         """Привести сырые данные к унифицированному виду."""
-        price_value, price_currency = await self._normalize_price(raw)
-        volume_l, abv_percent = await self._normalize_volume_abv(raw)
+        if self._llm_enabled:
+            # Цена, объём/крепость и секции независимы — вызовы LLM идут параллельно.
+            (price_value, price_currency), (volume_l, abv_percent), sections = (
+                await asyncio.gather(
+                    self._normalize_price(raw),
+                    self._normalize_volume_abv(raw),
+                    self._normalize_sections(raw.sections),
+                )
+            )
+        else:
+            price_value, price_currency = await self._normalize_price(raw)
+            volume_l, abv_percent = await self._normalize_volume_abv(raw)
+            sections = await self._normalize_sections(raw.sections)
 
         age_years = self._extract_age(raw)
         availability = self._normalize_availability(raw.availability_text)
 
-        sections = await self._normalize_sections(raw.sections)
-
         grapes_list = raw.grapes
         maybe_grapes = sections.get("grapes_list")
         if isinstance(maybe_grapes, list) and maybe_grapes:
@@ -123,7 +170,7 @@ class ProductNormalizer:
         if price_currency is None and price_value is not None:
             price_currency = "RUB"
 
-        if price_value is None and raw.price_text:
+        if self._llm_enabled and price_value is None and raw.price_text:
             llm_payload = await self._maybe_call_llm("price", raw.price_text)
             if llm_payload:
                 price_value = self._safe_float(llm_payload.get("price_value"))
@@ -135,8 +182,10 @@ class ProductNormalizer:
         volume_l = raw.volume_l or extract_float_with_unit(raw.volume_text)
         abv_percent = raw.abv_percent or extract_abv_percent(raw.abv_text)
 
-        if (volume_l is None or abv_percent is None) and (
-            raw.volume_text or raw.abv_text
+        if (
+            self._llm_enabled
+            and (volume_l is None or abv_percent is None)
+            and (raw.volume_text or raw.abv_text)
         ):
             source_text = " ".join(
                 filter(None, [raw.volume_text or "", raw.abv_text or ""])
@@ -149,11 +198,9 @@ class ProductNormalizer:
         return volume_l, abv_percent
 
     def _extract_age(self, raw: ProductRaw) -> Optional[int]:
-        candidates = [
-            raw.title or "",
-            raw.sections.get("maturation").text if raw.sections.get("maturation") else "",
-        ]
-        for text in candidates:
+        maturation_section = raw.sections.get("maturation")
+        texts = (raw.title, maturation_section.text if maturation_section else None)
+        for text in texts:
             if not text:
                 continue
             match = AGE_REGEX.search(text)
@@ -175,33 +222,25 @@ class ProductNormalizer:
         return None
 
     async def _normalize_sections(self, sections: Dict[str, ProductSection]) -> Dict[str, object]:
-        result: Dict[str, object] = {}
-
-        tasting_text, _ = await self._section_with_llm(sections.get("tasting_notes"))
-        result["tasting_notes"] = tasting_text
-
-        gastronomy_text, _ = await self._section_with_llm(sections.get("gastronomy"))
-        result["gastronomy"] = gastronomy_text
-
-        grapes_text, grapes_items = await self._section_with_llm(sections.get("grapes"))
-        result["grapes"] = grapes_text
-        result["grapes_list"] = grapes_items
-
-        maturation_text, _ = await self._section_with_llm(sections.get("maturation"))
-        result["maturation"] = maturation_text
-
-        awards_text, _ = await self._section_with_llm(sections.get("awards"))
-        result["awards"] = awards_text
-
-        producer_text, producer_items = await self._section_with_llm(sections.get("producer"))
-        if producer_items:
-            result["producer"] = producer_items[0]
+        if self._llm_enabled:
+            # Секции независимы: LLM-запросы идут параллельно, общий лимит задаёт LLMClient.
+            normalized = await asyncio.gather(
+                *(self._section_with_llm(sections.get(key)) for key in SECTION_FIELDS)
+            )
         else:
-            result["producer"] = producer_text
-
-        gift_packaging_text, _ = await self._section_with_llm(sections.get("gift_packaging"))
-        result["gift_packaging"] = gift_packaging_text
-
+            # Без LLM корутины не приостанавливаются — задачи для gather не нужны.
+            normalized = [
+                await self._section_with_llm(sections.get(key)) for key in SECTION_FIELDS
+            ]
+        result: Dict[str, object] = {}
+        for key, (text, items) in zip(SECTION_FIELDS, normalized):
+            if key == "grapes":
+                result["grapes"] = text
+                result["grapes_list"] = items
+            elif key == "producer":
+                result["producer"] = items[0] if items else text
+            else:
+                result[key] = text
         return result
 
     async def _section_with_llm(
@@ -213,7 +252,7 @@ class ProductNormalizer:
         items = [item for item in section.items if item]
         if text or items:
             return text, items
-        if section.html:
+        if self._llm_enabled and section.html:
             llm_payload = await self._maybe_call_llm(
                 "section", {"title": section.title, "html": section.html}
             )
@@ -239,6 +278,25 @@ class ProductNormalizer:
     ) -> Optional[Dict[str, object]]:
         if not self._llm_client:
             return None
+        # Успешные ответы кеширует LLMClient; здесь склеиваем одинаковые запросы,
+        # идущие параллельно, и не повторяем недавно упавшие.
+        key = _llm_request_key(mode, data)
+        failed_at = self._llm_failed_at.get(key)
+        if failed_at is not None:
+            if time.monotonic() - failed_at < LLM_FAILURE_TTL_SECONDS:
+                return None
+            del self._llm_failed_at[key]
+        task = self._llm_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call_llm(key, mode, data))
+            self._llm_inflight[key] = task
+            task.add_done_callback(lambda _: self._llm_inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _call_llm(
+        self, key: str, mode: str, data: object
+    ) -> Optional[Dict[str, object]]:
+        assert self._llm_client is not None
         try:
             if mode == "price":
                 LOGGER.info("LLM нормализация цены для %s", raw_value_preview(data))
@@ -262,6 +320,7 @@ class ProductNormalizer:
             return payload
         except LLMUnavailableError as exc:
             self.metrics.llm_failures += 1
+            self._llm_failed_at[key] = time.monotonic()
             LOGGER.warning("LLM недоступен (%s): %s", mode, exc)
             return None
 
@@ -275,6 +334,4 @@ class ProductNormalizer:
 
     def _fallback_product_id(self, url: str) -> str:
         """Fallback ID на основе URL (sha256)."""
-        import hashlib
-
-        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return _sha256_hex(url)
@@ -5,21 +5,22 @@ from __future__ import annotations
 import logging
 import re
 from dataclasses import dataclass
+from functools import lru_cache
 import asyncio
 from typing import Dict, List, Optional
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 
-from playwright.async_api import BrowserContext, Page
-from selectolax.parser import HTMLParser
+from playwright.async_api import BrowserContext, Page, Route
+from selectolax.parser import HTMLParser, Node
 
 from app.config import Settings
 from app.models import ProductLink, ProductRaw, ProductSection
 from app.playwright_helpers import close_age_confirmation
 from app.utils import (
+    RequestThrottle,
     clean_text,
-    extract_abv_percent,
-    extract_float_with_unit,
     extract_price_value,
+    extract_volume_and_abv,
     normalize_whitespace,
     split_multiline,
 )
@@ -37,6 +38,28 @@ SECTION_KEYS = {
     "производитель": "producer",
     "подарочная упаковка": "gift_packaging",
 }
+# Все префиксы заголовков одной альтернацией: один проход вместо цикла startswith.
+# Порядок альтернатив совпадает с порядком SECTION_KEYS (первый подходящий выигрывает).
+SECTION_KEY_RE = re.compile("|".join(re.escape(pattern) for pattern in SECTION_KEYS))
+
+# Классы одиночных полей карточки → ключ в результате `_collect_scalar_nodes`.
+SCALAR_CLASSES = {
+    "product__id": "sku",
+    "product__titles-name": "brand",
+    "product__buy-box-price": "price",
+    "product__buy-box-footer": "availability",
+}
+SCALAR_SELECTOR = ", ".join(
+    ["h1", "[data-product-id]", *(f".{name}" for name in SCALAR_CLASSES)]
+)
+
+SRCSET_SPLIT_RE = re.compile(r"\s*,\s*")
+
+# Ресурсы, не влияющие на HTML карточки: во вкладках парсера их не загружаем.
+BLOCKED_RESOURCE_RE = re.compile(
+    r"\.(?:png|jpe?g|gif|webp|avif|svg|ico|woff2?|ttf|otf|mp4|webm)(?:[?#]|$)",
+    re.IGNORECASE,
+)
 
 IMAGE_SELECTOR = (
     ".product__content-img img, "
@@ -47,6 +70,24 @@ IMAGE_SELECTOR = (
 )
 
 
+# Уникальных заголовков секций несколько десятков: ключ считаем один раз на строку.
+@lru_cache(maxsize=256)
+def _section_key(title: str) -> Optional[str]:
+    """Сопоставить заголовок секции с ключом из SECTION_KEYS."""
+    match = SECTION_KEY_RE.match(title.lower().rstrip(":"))
+    return SECTION_KEYS[match.group(0)] if match else None
+
+
+def _absolute_url(src: str, base_url: str, origin: str) -> str:
+    """Абсолютный URL изображения; urljoin только для нетипичных относительных путей."""
+    if src.startswith(("https://", "http://")):
+        return src
+    # Путь от корня без `./`/`../`: urljoin дал бы тот же результат.
+    if src.startswith("/") and not src.startswith("//") and "/." not in src:
+        return origin + src
+    return urljoin(base_url, src)
+
+
 @dataclass(slots=True)
 class ProductParserMetrics:
     """Метрики работы парсера товаров."""
@@ -58,33 +99,47 @@ class ProductParserMetrics:
 class ProductPageParser:
     """Загружает страницы товара и извлекает данные."""
 
-    def __init__(self, settings: Settings) -> None:
+    def __init__(
+        self, settings: Settings, throttle: Optional[RequestThrottle] = None
+    ) -> None:
         self._settings = settings
+        self._throttle = throttle or RequestThrottle(settings.request_delay_seconds)
         self.metrics = ProductParserMetrics()
+        # Пул вкладок: не больше max_concurrency, создаются лениво и переиспользуются.
+        # Семафор считает выданные вкладки: слот освобождается при любом возврате,
+        # поэтому ожидающий получит вкладку и после закрытия сломанной.
+        self._page_pool: "asyncio.Queue[Page]" = asyncio.Queue()
+        self._page_slots = asyncio.Semaphore(settings.max_concurrency)
 
     async def parse(self, context: BrowserContext, link: ProductLink) -> ProductRaw:
         """Загрузить страницу и вернуть сырые данные карточки."""
         attempts_left = self._settings.max_retries + 1
         last_error: Optional[Exception] = None
         while attempts_left:
-            page = await context.new_page()
+            page = await self._acquire_page(context)
+            page_healthy = False
             try:
                 LOGGER.info(
                     "Загрузка страницы товара: %s (попытка %s)",
                     link.url,
                     (self._settings.max_retries + 2) - attempts_left,
                 )
+                await self._throttle.wait()
                 await page.goto(
                     link.url,
-                    wait_until="networkidle",
+                    wait_until="domcontentloaded",
                     timeout=self._settings.navigation_timeout_ms,
                 )
                 await close_age_confirmation(page)
                 await page.wait_for_selector(
-                    "h1", timeout=self._settings.navigation_timeout_ms
+                    "h1",
+                    state="attached",
+                    timeout=self._settings.navigation_timeout_ms,
                 )
                 html = await page.content()
 
+                page_healthy = True
+
                 product = self._parse_html(html, link)
                 self.metrics.products_parsed += 1
                 LOGGER.info("Страница товара загружена и распарсена: %s", link.url)
@@ -99,26 +154,68 @@ class ProductPageParser:
                     attempts_left,
                     exc,
                 )
-                if attempts_left > 0:
-                    await asyncio.sleep(self._settings.request_delay_ms / 1000)
-                else:
+                if attempts_left == 0:
                     LOGGER.exception("Failed to parse product page: %s", link.url)
                     raise
             finally:
-                try:
-                    await page.wait_for_timeout(self._settings.request_delay_ms)
-                finally:
-                    await page.close()
+                await self._release_page(page, page_healthy)
+
+    async def aclose(self) -> None:
+        """Закрыть вкладки, оставшиеся в пуле."""
+        while not self._page_pool.empty():
+            page = self._page_pool.get_nowait()
+            try:
+                await page.close()
+            except Exception:  # pragma: no cover - контекст уже мог быть закрыт
+                LOGGER.debug("Вкладка из пула уже закрыта")
+
+    async def _acquire_page(self, context: BrowserContext) -> Page:
+        """Взять свободную вкладку из пула или открыть новую, пока не достигнут лимит."""
+        await self._page_slots.acquire()
+        if not self._page_pool.empty():
+            return self._page_pool.get_nowait()
+        try:
+            page = await context.new_page()
+        except BaseException:
+            self._page_slots.release()
+            raise
+        try:
+            await page.route(BLOCKED_RESOURCE_RE, self._abort_route)
+        except BaseException:
+            # Вкладка уже открыта — закрываем, чтобы она не осталась вне пула.
+            await self._release_page(page, healthy=False)
+            raise
+        return page
+
+    @staticmethod
+    async def _abort_route(route: Route) -> None:
+        await route.abort()
+
+    async def _release_page(self, page: Page, healthy: bool) -> None:
+        """Вернуть вкладку в пул; после сбоя вкладку закрываем и не переиспользуем."""
+        try:
+            if healthy and not page.is_closed():
+                self._page_pool.put_nowait(page)
+                return
+            try:
+                await page.close()
+            except Exception:  # pragma: no cover - вкладка могла упасть вместе с рендерером
+                LOGGER.debug("Не удалось закрыть вкладку после ошибки")
+        finally:
+            # Слот освобождаем в любом случае: ожидающий возьмёт вкладку из пула
+            # или откроет новую вместо закрытой.
+            self._page_slots.release()
 
     def _parse_html(self, html: str, link: ProductLink) -> ProductRaw:
         tree = HTMLParser(html)
 
-        title = clean_text(self._text_or_none(tree.css_first("h1")))
-        sku_text = clean_text(self._text_or_none(tree.css_first(".product__id")))
+        scalar_nodes = self._collect_scalar_nodes(tree)
+        title = clean_text(self._text_or_none(scalar_nodes.get("title")))
+        sku_text = clean_text(self._text_or_none(scalar_nodes.get("sku")))
         sku = self._extract_sku(sku_text)
-        product_id = self._extract_product_id(tree)
+        product_id = self._extract_product_id(scalar_nodes.get("product_id"))
 
-        brand = clean_text(self._text_or_none(tree.css_first(".product__titles-name")))
+        brand = clean_text(self._text_or_none(scalar_nodes.get("brand")))
         country = self._extract_country(tree)
 
         breadcrumbs = self._extract_breadcrumbs(tree)
@@ -128,14 +225,13 @@ class ProductPageParser:
             for node in tree.css(".product__facts-item")
             if node
         ]
-        volume_text = self._first_matching(facts_texts, "л")
-        abv_text = self._first_matching(facts_texts, "%")
-
-        price_text = clean_text(
-            self._text_or_none(tree.css_first(".product__buy-box-price"))
+        volume_text, volume_l, abv_text, abv_percent = extract_volume_and_abv(
+            facts_texts
         )
+
+        price_text = clean_text(self._text_or_none(scalar_nodes.get("price")))
         availability_text = clean_text(
-            self._text_or_none(tree.css_first(".product__buy-box-footer"))
+            self._text_or_none(scalar_nodes.get("availability"))
         )
 
         sections = self._extract_sections(tree)
@@ -161,17 +257,33 @@ class ProductPageParser:
             price_value=extract_price_value(price_text),
             price_currency="RUB" if price_text else None,
             volume_text=volume_text,
-            volume_l=extract_float_with_unit(volume_text),
+            volume_l=volume_l,
             abv_text=abv_text,
-            abv_percent=extract_abv_percent(abv_text),
+            abv_percent=abv_percent,
             availability_text=availability_text,
             grapes=grapes,
             sections=sections,
             image_urls=image_urls,
             hero_image_url=image_urls[0] if image_urls else None,
-            raw_html=html,
+            # HTML страницы (~сотни КБ) иначе едет через весь пайплайн вместе с карточкой.
+            raw_html=html if self._settings.capture_product_html else "",
         )
 
+    def _collect_scalar_nodes(self, tree: HTMLParser) -> Dict[str, Node]:
+        """Найти одиночные поля карточки одним обходом DOM вместо css_first на каждое."""
+        found: Dict[str, Node] = {}
+        for node in tree.css(SCALAR_SELECTOR):
+            if node.tag == "h1":
+                found.setdefault("title", node)
+            attributes = node.attributes
+            if "data-product-id" in attributes:
+                found.setdefault("product_id", node)
+            for class_name in (attributes.get("class") or "").split():
+                key = SCALAR_CLASSES.get(class_name)
+                if key:
+                    found.setdefault(key, node)
+        return found
+
     def _extract_country(self, tree: HTMLParser) -> Optional[str]:
         region_node = tree.css_first(".product__titles-region a")
         if region_node:
@@ -194,8 +306,7 @@ class ProductPageParser:
             if not title_raw:
                 continue
 
-            normalized = title_raw.lower().rstrip(":")
-            key = self._match_section_key(normalized)
+            key = _section_key(title_raw)
             if not key:
                 continue
 
@@ -244,15 +355,17 @@ class ProductPageParser:
 
     def _extract_images(self, tree: HTMLParser, base_url: str) -> List[str]:
         weighted: Dict[str, float] = {}
+        parsed_base = urlsplit(base_url)
+        origin = f"{parsed_base.scheme}://{parsed_base.netloc}"
         for node in tree.css(IMAGE_SELECTOR):
             src = node.attributes.get("src")
             if src:
-                absolute = urljoin(base_url, src)
+                absolute = _absolute_url(src, base_url, origin)
                 self._register_image(weighted, absolute, weight=1.0)
             srcset = node.attributes.get("srcset")
             if srcset:
                 for candidate, descriptor in self._parse_srcset(srcset):
-                    absolute = urljoin(base_url, candidate)
+                    absolute = _absolute_url(candidate, base_url, origin)
                     weight = self._descriptor_weight(descriptor)
                     self._register_image(weighted, absolute, weight=weight)
         sorted_urls = [
@@ -272,8 +385,8 @@ class ProductPageParser:
 
     def _parse_srcset(self, srcset: str) -> List[tuple[str, str]]:
         candidates: List[tuple[str, str]] = []
-        for chunk in srcset.split(","):
-            parts = chunk.strip().split()
+        for chunk in SRCSET_SPLIT_RE.split(srcset):
+            parts = chunk.split()
             if not parts:
                 continue
             url = parts[0]
@@ -295,12 +408,6 @@ class ProductPageParser:
                 return 1.0
         return 1.0
 
-    def _match_section_key(self, normalized_title: str) -> Optional[str]:
-        for pattern, key in SECTION_KEYS.items():
-            if normalized_title.startswith(pattern):
-                return key
-        return None
-
     def _text_or_none(self, node) -> Optional[str]:
         if node is None:
             return None
@@ -314,17 +421,8 @@ class ProductPageParser:
             return match.group(1)
         return sku_text.replace("Артикул:", "").strip()
 
-    def _extract_product_id(self, tree: HTMLParser) -> Optional[str]:
-        node = tree.css_first("[data-product-id]")
+    def _extract_product_id(self, node: Optional[Node]) -> Optional[str]:
         if not node:
             return None
         data_attr = node.attributes.get("data-product-id")
         return clean_text(data_attr)
-
-    def _first_matching(self, texts: List[Optional[str]], marker: str) -> Optional[str]:
-        for value in texts:
-            if not value:
-                continue
-            if marker.lower() in value.lower():
-                return value
-        return None
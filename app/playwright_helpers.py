@@ -2,7 +2,9 @@
 
 from __future__ import annotations
 
-from playwright.async_api import Locator, Page
+from weakref import WeakSet
+
+from playwright.async_api import BrowserContext, Locator, Page
 
 
 AGE_CONFIRM_SELECTORS = [
@@ -11,15 +13,27 @@ AGE_CONFIRM_SELECTORS = [
     "[data-modal-id='age-confirm'] button.ui-button",
 ]
 
+# Контексты, в которых возраст уже подтверждён: сайт запоминает это в cookie,
+# поэтому на следующих страницах модалка не появляется и проверки не нужны.
+_CONFIRMED_CONTEXTS: "WeakSet[BrowserContext]" = WeakSet()
+
+
+async def close_age_confirmation(page: Page, *, remember: bool = True) -> None:
+    """Закрыть модальное окно подтверждения возраста, если оно появилось.
 
-async def close_age_confirmation(page: Page) -> None:
-    """Закрыть модальное окно подтверждения возраста, если оно появилось."""
+    ``remember=False`` — не отмечать контекст подтверждённым: на странице без CSS
+    видимость модалки определяется ненадёжно.
+    """
+    if page.context in _CONFIRMED_CONTEXTS:
+        return
     for selector in AGE_CONFIRM_SELECTORS:
         try:
             locator: Locator = page.locator(selector)
             if await locator.first.is_visible(timeout=500):
                 await locator.first.click()
                 await page.wait_for_timeout(200)
+                if remember:
+                    _CONFIRMED_CONTEXTS.add(page.context)
                 return
         except Exception:
             # Игнорируем любые ошибки, модалка просто не появилась.
@@ -1,5 +1,5 @@
 """Интерфейс записи данных в Google Sheets."""
 
-from .service import SheetRecord, SheetsWriter
+from .service import SheetRecord, SheetsWriter, SheetsWriterMetrics
 
-__all__ = ["SheetsWriter", "SheetRecord"]
+__all__ = ["SheetsWriter", "SheetRecord", "SheetsWriterMetrics"]
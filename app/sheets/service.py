@@ -3,17 +3,20 @@
 from __future__ import annotations
 
 import asyncio
-import json
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-import gspread
-from google.oauth2 import service_account
-from gspread.exceptions import WorksheetNotFound
-from gspread.utils import rowcol_to_a1
+import orjson
 import logging
 
+# gspread и google-auth тянут десятки модулей (~150 мс при старте) — импортируем
+# их в методах, которые выполняются только при включённой записи в Sheets.
+if TYPE_CHECKING:
+    import gspread
+    from google.auth.transport.requests import AuthorizedSession
+
 from app.config import Settings
 from app.state import StateRepository
 
@@ -22,6 +25,15 @@ SHEETS_SCOPES = [
     "https://www.googleapis.com/auth/drive",
 ]
 
+# Повторы запросов к Sheets API на уровне HTTP-адаптера (с экспоненциальной паузой).
+SHEETS_HTTP_RETRIES = 3
+SHEETS_HTTP_BACKOFF = 0.5
+SHEETS_RETRY_STATUSES = (429, 500, 502, 503, 504)
+SHEETS_POOL_SIZE = 4
+
+# Сколько записей копим перед отправкой пачки в Google Sheets.
+ROW_FLUSH_BATCH_SIZE = 50
+
 SHEET_COLUMNS: List[str] = [
     "PRODUCT_URL",
     "POSITION",
@@ -44,6 +56,14 @@ SHEET_COLUMNS: List[str] = [
     "ERROR_MSG",
 ]
 
+# Номера колонок (1-based, как в API Sheets) считаем один раз при импорте.
+COLUMN_NUMBERS: Dict[str, int] = {
+    name: number for number, name in enumerate(SHEET_COLUMNS, start=1)
+}
+PRODUCT_URL_COL = COLUMN_NUMBERS["PRODUCT_URL"]
+POSITION_COL = COLUMN_NUMBERS["POSITION"]
+PRODUCT_URL_INDEX = PRODUCT_URL_COL - 1
+
 
 def _column_letter(index: int) -> str:
     """Преобразовать индекс колонки (1-based) в буквенное представление A..Z."""
@@ -56,30 +76,84 @@ def _column_letter(index: int) -> str:
     return "".join(reversed(result))
 
 
+# Схема фиксирована — последняя колонка диапазона строки известна при импорте.
+LAST_COLUMN_LETTER = _column_letter(len(SHEET_COLUMNS))
+
+
+# Числовых значений в каталоге немного (объёмы, крепость, типовые цены) —
+# строковое представление считаем один раз на значение.
+@lru_cache(maxsize=2048)
+def _format_number(value: Optional[float]) -> str:
+    """Число без лишних нулей после запятой (до двух знаков)."""
+    if value is None:
+        return ""
+    # Целые (возраст) не нужно форматировать с дробной частью и обрезать обратно.
+    if type(value) is int:
+        return str(value)
+    formatted = f"{value:.2f}"
+    return formatted.rstrip("0").rstrip(".") if "." in formatted else formatted
+
+
+def _grapes_json(grapes: List[str]) -> str:
+    """JSON-массив сортов в формате ``json.dumps(ensure_ascii=False)``.
+
+    Разделитель ", " как раньше: компактный вывод orjson изменил бы строку
+    в уже заполненных ячейках GRAPES_JSON.
+    """
+    return "[" + ", ".join(orjson.dumps(grape).decode() for grape in grapes) + "]"
+
+
 @dataclass(slots=True)
 class SheetRecord:
     """Данные для записи строки в Google Sheets."""
 
     unique_key: str
-    values: Dict[str, Optional[str]]
+    # Значения строго в порядке SHEET_COLUMNS.
+    values: Tuple[str, ...]
 
-    def to_row(self) -> List[Optional[str]]:
-        return [self.values.get(column, "") for column in SHEET_COLUMNS]
+    def to_row(self) -> List[str]:
+        return list(self.values)
+
+
+@dataclass(slots=True)
+class SheetsWriterMetrics:
+    """Метрики записи в Google Sheets."""
+
+    rows_inserted: int = 0
+    rows_updated: int = 0
+    batches_flushed: int = 0
 
 
 class SheetsWriter:
-    """Обновляет Google Sheets, выполняя upsert-записи по PRODUCT_URL."""
+    """Обновляет Google Sheets, выполняя upsert-записи по PRODUCT_URL.
+
+    Записи копятся в буфере и отправляются пачками (`flush`): обновления —
+    одним `batch_update`, новые строки — одним `append_rows`.
+    """
 
-    def __init__(self, settings: Settings, state: StateRepository) -> None:
+    def __init__(
+        self,
+        settings: Settings,
+        state: StateRepository,
+        batch_size: int = ROW_FLUSH_BATCH_SIZE,
+    ) -> None:
         self._settings = settings
         self._state = state
         self._enabled = self._is_enabled()
         self._client: Optional[gspread.Client] = None
         self._worksheet = None
+        self._batch_size = max(1, batch_size)
+        self._pending: Dict[str, SheetRecord] = {}
+        # PRODUCT_URL → номер строки; читается из таблицы один раз за запуск.
+        self._row_index: Optional[Dict[str, int]] = None
+        # Заголовок за время запуска не меняется — проверяем его один раз.
+        self._header_ok = False
+        self._flush_lock = asyncio.Lock()
         self._logger = logging.getLogger(__name__)
+        self.metrics = SheetsWriterMetrics()
 
     async def upsert(self, record: SheetRecord) -> str:
-        """Добавить или обновить строку и вернуть статус new/updated/skipped."""
+        """Поставить запись в очередь на запись; вернуть статус queued/skipped."""
         if not self._enabled:
             self._logger.info(
                 "Пропуск записи в Sheets: сервис отключён или отсутствуют креды."
@@ -93,31 +167,44 @@ class SheetsWriter:
             )
             return "skipped"
 
-        await asyncio.to_thread(self._ensure_header, worksheet)
-
-        row_values = record.to_row()
-        existing_row = await asyncio.to_thread(
-            self._find_row_index, worksheet, record.unique_key
-        )
-
-        if existing_row:
-            await asyncio.to_thread(
-                self._update_row, worksheet, existing_row, row_values
-            )
+        # Повторная запись той же карточки до flush заменяет предыдущую.
+        self._pending[record.unique_key] = record
+        if len(self._pending) >= self._batch_size:
+            await self.flush()
+        return "queued"
+
+    async def flush(self) -> None:
+        """Отправить накопленные записи в Google Sheets."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            worksheet = await self._get_worksheet()
+            if worksheet is None:
+                return
+            records = list(self._pending.values())
+            self._pending.clear()
+            try:
+                inserted, updated = await asyncio.to_thread(
+                    self._write_batch, worksheet, records
+                )
+            except Exception:
+                # Записи не потеряны: вернём в буфер (если за время записи не пришли
+                # более свежие) и отправим при следующем flush.
+                for record in records:
+                    self._pending.setdefault(record.unique_key, record)
+                raise
+            self.metrics.rows_inserted += inserted
+            self.metrics.rows_updated += updated
+            self.metrics.batches_flushed += 1
             self._logger.info(
-                "Строка Sheets обновлена (row=%s, key=%s)",
-                existing_row,
-                record.unique_key,
+                "Sheets: отправлена пачка (новых строк %s, обновлено %s)",
+                inserted,
+                updated,
             )
-            return "updated"
 
-        await asyncio.to_thread(
-            worksheet.append_row,
-            row_values,
-            value_input_option="USER_ENTERED",
-        )
-        self._logger.info("Добавлена новая строка в Sheets (key=%s)", record.unique_key)
-        return "new"
+    def has_pending(self, unique_key: str) -> bool:
+        """Запись ещё не отправлена в Sheets (ждёт flush или вернулась после ошибки)."""
+        return unique_key in self._pending
 
     def build_record(
         self,
@@ -142,27 +229,29 @@ class SheetsWriter:
         error_msg: Optional[str] = None,
     ) -> SheetRecord:
         """Подготовить запись для Google Sheets."""
-        values: Dict[str, Optional[str]] = {
-            "PRODUCT_URL": product_url,
-            "POSITION": str(position),
-            "TITLE": title or "",
-            "PRICE_VALUE": self._format_number(price_value),
-            "COUNTRY": country or "",
-            "VOLUME_L": self._format_number(volume_l),
-            "ABV_PERCENT": self._format_number(abv_percent),
-            "AGE_YEARS": self._format_number(age_years),
-            "BRAND": brand or "",
-            "PRODUCER": producer or "",
-            "TASTING_NOTES": tasting_notes or "",
-            "GASTRONOMY": gastronomy or "",
-            "GRAPES_JSON": json.dumps(grapes, ensure_ascii=False),
-            "MATURATION": maturation or "",
-            "GIFT_PACKAGING": gift_packaging or "",
-            "IMAGE_DIRECT_URL": image_direct_url or "",
-            "IMAGE_CELL": f"=IMAGE(\"{image_direct_url}\")" if image_direct_url else "",
-            "STATUS": status,
-            "ERROR_MSG": error_msg or "",
-        }
+        image_cell = f"=IMAGE(\"{image_direct_url}\")" if image_direct_url else ""
+        # Порядок элементов совпадает с SHEET_COLUMNS.
+        values = (
+            product_url,  # PRODUCT_URL
+            str(position),  # POSITION
+            title or "",  # TITLE
+            _format_number(price_value),  # PRICE_VALUE
+            country or "",  # COUNTRY
+            _format_number(volume_l),  # VOLUME_L
+            _format_number(abv_percent),  # ABV_PERCENT
+            _format_number(age_years),  # AGE_YEARS
+            brand or "",  # BRAND
+            producer or "",  # PRODUCER
+            tasting_notes or "",  # TASTING_NOTES
+            gastronomy or "",  # GASTRONOMY
+            _grapes_json(grapes),  # GRAPES_JSON
+            maturation or "",  # MATURATION
+            gift_packaging or "",  # GIFT_PACKAGING
+            image_direct_url or "",  # IMAGE_DIRECT_URL
+            image_cell,  # IMAGE_CELL
+            status,  # STATUS
+            error_msg or "",  # ERROR_MSG
+        )
         return SheetRecord(unique_key=product_url, values=values)
 
     async def get_last_position(self) -> int:
@@ -174,11 +263,12 @@ class SheetsWriter:
         if worksheet is None:
             self._logger.warning("Worksheet недоступен, продолжаем с первой позиции.")
             return 0
+        import gspread
+
         await asyncio.to_thread(self._ensure_header, worksheet)
         try:
-            col_idx = SHEET_COLUMNS.index("POSITION") + 1
             column_values = await asyncio.to_thread(
-                worksheet.col_values, col_idx
+                worksheet.col_values, POSITION_COL
             )
         except gspread.exceptions.APIError as exc:
             self._logger.warning(
@@ -186,54 +276,106 @@ class SheetsWriter:
             )
             return 0
 
-        max_position = 0
-        for value in column_values[1:]:
-            if not value:
-                continue
-            try:
-                position = int(value)
-            except ValueError:
-                continue
-            if position > max_position:
-                max_position = position
+        # isdecimal отсекает пустые и нечисловые ячейки без try/except на каждую.
+        max_position = max(
+            (int(value) for value in column_values[1:] if value.isdecimal()),
+            default=0,
+        )
         self._logger.info("Последняя обработанная позиция в Sheets: %s", max_position)
         return max_position
 
     def _ensure_header(self, worksheet) -> None:
+        if self._header_ok:
+            return
         current_header = worksheet.row_values(1)
         if current_header == SHEET_COLUMNS:
+            self._header_ok = True
             return
         if current_header:
             # Дополним существующими колонками, чтобы не потерять данные.
             worksheet.update(
-                f"A1:{_column_letter(len(SHEET_COLUMNS))}1",
+                f"A1:{LAST_COLUMN_LETTER}1",
                 [SHEET_COLUMNS],
                 value_input_option="RAW",
             )
         else:
             worksheet.append_row(SHEET_COLUMNS, value_input_option="RAW")
+        self._header_ok = True
         self._logger.info("Заголовок Google Sheets синхронизирован с текущей схемой.")
 
-    def _find_row_index(self, worksheet, unique_key: str) -> Optional[int]:
-        product_id_col = SHEET_COLUMNS.index("PRODUCT_URL") + 1
+    def _write_batch(self, worksheet, records: List[SheetRecord]) -> Tuple[int, int]:
+        """Записать пачку: один снимок колонки URL, один batch_update, один append."""
+        self._ensure_header(worksheet)
+        if self._row_index is None:
+            self._row_index = self._load_row_index(worksheet)
+        row_index = self._row_index
+
+        updates: List[Dict[str, object]] = []
+        new_rows: List[List[str]] = []
+        for record in records:
+            existing_row = row_index.get(record.unique_key)
+            if existing_row:
+                updates.append(
+                    {
+                        "range": self._row_range(existing_row),
+                        "values": [record.to_row()],
+                    }
+                )
+            else:
+                new_rows.append(record.to_row())
+
+        if updates:
+            worksheet.batch_update(updates, value_input_option="USER_ENTERED")
+        if new_rows:
+            response = worksheet.append_rows(
+                new_rows, value_input_option="USER_ENTERED"
+            )
+            first_row = self._first_appended_row(response)
+            if first_row is None:
+                # Не знаем, куда легли строки, — перечитаем колонку при следующей пачке.
+                self._row_index = None
+            else:
+                for offset, row in enumerate(new_rows):
+                    row_index[row[PRODUCT_URL_INDEX]] = first_row + offset
+        return len(new_rows), len(updates)
+
+    def _first_appended_row(self, response) -> Optional[int]:
+        import gspread
+        from gspread.utils import a1_to_rowcol
+
+        try:
+            updated_range = response["updates"]["updatedRange"]
+            first_cell = updated_range.split("!")[-1].split(":")[0]
+            return a1_to_rowcol(first_cell)[0]
+        except (
+            KeyError,
+            TypeError,
+            IndexError,
+            gspread.exceptions.IncorrectCellLabel,
+        ):
+            return None
+
+    def _load_row_index(self, worksheet) -> Dict[str, int]:
+        import gspread
+
         try:
-            column_values = worksheet.col_values(product_id_col)
+            column_values = worksheet.col_values(PRODUCT_URL_COL)
         except gspread.exceptions.APIError as exc:
+            # Пустой индекс продублировал бы существующие строки: пробрасываем
+            # ошибку, flush вернёт записи в буфер, а колонка перечитается позже.
             self._logger.warning(
                 "Не удалось получить столбец PRODUCT_URL из Sheets: %s", exc
             )
-            return None
-
+            raise
+        row_index: Dict[str, int] = {}
         for index, value in enumerate(column_values[1:], start=2):
-            if value == unique_key:
-                return index
-        return None
+            if value:
+                # При дублях URL обновляем первую строку, как прежний поиск по колонке.
+                row_index.setdefault(value, index)
+        return row_index
 
-    def _update_row(self, worksheet, row_index: int, values: List[Optional[str]]) -> None:
-        last_cell = rowcol_to_a1(row_index, len(SHEET_COLUMNS))
-        last_col = "".join(filter(str.isalpha, last_cell))
-        range_name = f"A{row_index}:{last_col}{row_index}"
-        worksheet.update(range_name, [values], value_input_option="USER_ENTERED")
+    def _row_range(self, row_index: int) -> str:
+        return f"A{row_index}:{LAST_COLUMN_LETTER}{row_index}"
 
     async def _get_worksheet(self):
         if self._worksheet is not None:
@@ -242,6 +384,8 @@ class SheetsWriter:
         if client is None:
             self._logger.warning("Клиент Google Sheets недоступен, worksheet не получен.")
             return None
+        import gspread
+
         try:
             spreadsheet = await asyncio.to_thread(
                 client.open_by_key, self._settings.gsheet_id
@@ -254,7 +398,11 @@ class SheetsWriter:
                 self._settings.gsheet_tab,
                 self._settings.gsheet_id,
             )
-        except (WorksheetNotFound, gspread.SpreadsheetNotFound, gspread.exceptions.APIError) as exc:
+        except (
+            gspread.WorksheetNotFound,
+            gspread.SpreadsheetNotFound,
+            gspread.exceptions.APIError,
+        ) as exc:
             self._logger.warning("Не удалось открыть лист Google Sheets: %s", exc)
             return None
         return self._worksheet
@@ -262,6 +410,8 @@ class SheetsWriter:
     async def _get_client(self) -> Optional[gspread.Client]:
         if self._client is not None:
             return self._client
+        import gspread
+
         try:
             credentials = await asyncio.to_thread(self._load_credentials)
             if credentials is None:
@@ -270,6 +420,7 @@ class SheetsWriter:
             self._client = await asyncio.to_thread(
                 gspread.authorize,
                 credentials,
+                session=self._build_session(credentials),
             )
             self._logger.info("Авторизация в Google Sheets выполнена успешно.")
         except (OSError, ValueError, gspread.exceptions.APIError) as exc:
@@ -277,10 +428,38 @@ class SheetsWriter:
             return None
         return self._client
 
+    def _build_session(self, credentials) -> AuthorizedSession:
+        """HTTP-сессия gspread: пул keep-alive соединений и повторы при сбоях API."""
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = AuthorizedSession(credentials)
+        # requests уже запрашивает gzip по умолчанию; фиксируем явно для ответов API.
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        retry = Retry(
+            total=SHEETS_HTTP_RETRIES,
+            backoff_factor=SHEETS_HTTP_BACKOFF,
+            status_forcelist=SHEETS_RETRY_STATUSES,
+            # POST (append/batchUpdate) при 5xx мог примениться — повторяем только
+            # идемпотентные методы; ошибки соединения повторяются для всех.
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            # После исчерпания повторов отдаём gspread последний ответ: он поднимет
+            # APIError, которую обрабатывают вызывающие методы (а не RetryError).
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=SHEETS_POOL_SIZE, max_retries=retry
+        )
+        session.mount("https://", adapter)
+        return session
+
     def _load_credentials(self):
         self._logger.debug(
             "Чтение файла сервисного аккаунта: %s", self._settings.google_sa_json
         )
+        from google.oauth2 import service_account
+
         return service_account.Credentials.from_service_account_file(
             self._settings.google_sa_json,
             scopes=SHEETS_SCOPES,
@@ -296,8 +475,3 @@ class SheetsWriter:
                 self._settings.google_sa_json,
             )
         return enabled
-
-    def _format_number(self, value: Optional[float]) -> str:
-        if value is None:
-            return ""
-        return f"{value:.2f}".rstrip("0").rstrip(".")
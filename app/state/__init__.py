@@ -0,0 +1,5 @@
+"""Слой состояния пайплайна на SQLite."""
+
+from .service import ImageRecord, ProductRecord, StateRepository
+
+__all__ = ["StateRepository", "ProductRecord", "ImageRecord"]
@@ -0,0 +1,358 @@
+"""Хранилище состояния пайплайна (SQLite): карточки и загруженные изображения."""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+LOGGER = logging.getLogger(__name__)
+
+# Сколько изменённых карточек копим в памяти перед записью одним executemany.
+PRODUCT_FLUSH_BATCH_SIZE = 50
+
+# Сколько исходных URL изображений держим в LRU-кеше (включая промахи).
+IMAGE_URL_CACHE_SIZE = 4096
+
+# Сколько значений подставляем в один запрос `IN (...)` (лимит переменных SQLite).
+SQL_IN_CHUNK_SIZE = 500
+
+IMAGE_COLUMNS = (
+    "sha256",
+    "direct_url",
+    "viewer_url",
+    "thumb_url",
+    "original_url",
+    "updated_at",
+)
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    """Сохранённое состояние карточки товара."""
+
+    product_url: str
+    product_id: Optional[str]
+    etag_hash: Optional[str]
+    image_sha256: Optional[str]
+    updated_at: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ImageRecord:
+    """Сведения о загруженном изображении."""
+
+    sha256: str
+    direct_url: Optional[str]
+    viewer_url: Optional[str]
+    thumb_url: Optional[str]
+    original_url: Optional[str]
+    updated_at: Optional[str] = None
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class StateRepository:
+    """Репозиторий состояния: одно соединение, кеш чтений и пакетная запись карточек."""
+
+    def __init__(
+        self,
+        db_path: Union[str, Path],
+        batch_size: int = PRODUCT_FLUSH_BATCH_SIZE,
+    ) -> None:
+        self._path = Path(db_path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._batch_size = max(1, batch_size)
+        self._conn = sqlite3.connect(self._path)
+        self._conn.row_factory = sqlite3.Row
+        # WAL + NORMAL: без fsync на каждый commit, устойчивость достаточна для кеша.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Временные индексы/сортировки (ORDER BY в выборках изображений) — в памяти.
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+
+        self._pending_products: Dict[str, ProductRecord] = {}
+        self._product_cache: Dict[str, Optional[ProductRecord]] = {}
+        self._image_cache: Dict[str, Optional[ImageRecord]] = {}
+        self._image_by_original_cache: "OrderedDict[str, Optional[ImageRecord]]" = (
+            OrderedDict()
+        )
+
+        self._init_schema()
+
+    def get_product(self, product_url: str) -> Optional[ProductRecord]:
+        """Получить состояние карточки (с учётом ещё не записанных изменений)."""
+        if product_url in self._product_cache:
+            return self._product_cache[product_url]
+        row = self._conn.execute(
+            "SELECT product_url, product_id, etag_hash, image_sha256, updated_at "
+            "FROM visited_urls WHERE product_url = ?",
+            (product_url,),
+        ).fetchone()
+        record = ProductRecord(**dict(row)) if row else None
+        self._product_cache[product_url] = record
+        return record
+
+    def upsert_product(
+        self,
+        product_url: str,
+        product_id: Optional[str],
+        etag_hash: Optional[str],
+        image_sha256: Optional[str],
+    ) -> None:
+        """Запомнить состояние карточки; запись в БД выполняется пачками."""
+        record = ProductRecord(
+            product_url=product_url,
+            product_id=product_id,
+            etag_hash=etag_hash,
+            image_sha256=image_sha256,
+            updated_at=_utc_now(),
+        )
+        self._pending_products[product_url] = record
+        self._product_cache[product_url] = record
+        if len(self._pending_products) >= self._batch_size:
+            self.flush()
+
+    def set_product_image(self, product_url: str, image_sha256: str) -> None:
+        """Дописать SHA-256 изображения карточке, сохранённой до его расчёта."""
+        record = self._product_cache.get(product_url)
+        if record is not None:
+            record.image_sha256 = image_sha256
+        if product_url in self._pending_products:
+            # Запись ещё в буфере — SHA уйдёт в БД вместе с ней.
+            return
+        with self._conn:
+            self._conn.execute(
+                "UPDATE visited_urls SET image_sha256 = ? WHERE product_url = ?",
+                (image_sha256, product_url),
+            )
+
+    def flush(self) -> None:
+        """Записать накопленные изменения карточек одной транзакцией."""
+        if not self._pending_products:
+            return
+        rows = [
+            (
+                record.product_url,
+                record.product_id,
+                record.etag_hash,
+                record.image_sha256,
+                record.updated_at,
+            )
+            for record in self._pending_products.values()
+        ]
+        with self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO visited_urls (
+                    product_url, product_id, etag_hash, image_sha256, updated_at
+                ) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(product_url) DO UPDATE SET
+                    product_id = excluded.product_id,
+                    etag_hash = excluded.etag_hash,
+                    image_sha256 = excluded.image_sha256,
+                    updated_at = excluded.updated_at
+                """,
+                rows,
+            )
+        LOGGER.debug("State: записано карточек: %s", len(rows))
+        self._pending_products.clear()
+
+    def get_image(self, sha256: str) -> Optional[ImageRecord]:
+        """Найти изображение по SHA-256."""
+        if sha256 in self._image_cache:
+            return self._image_cache[sha256]
+        row = self._conn.execute(
+            f"SELECT {', '.join(IMAGE_COLUMNS)} FROM image_hashes WHERE sha256 = ?",
+            (sha256,),
+        ).fetchone()
+        record = ImageRecord(**dict(row)) if row else None
+        self._image_cache[sha256] = record
+        return record
+
+    def get_images(self, sha256s: Iterable[str]) -> Dict[str, ImageRecord]:
+        """Найти изображения для набора SHA-256 за минимум запросов."""
+        found: Dict[str, ImageRecord] = {}
+        missing: List[str] = []
+        for sha256 in dict.fromkeys(sha256s):
+            if sha256 in self._image_cache:
+                record = self._image_cache[sha256]
+                if record is not None:
+                    found[sha256] = record
+            else:
+                missing.append(sha256)
+
+        for start in range(0, len(missing), SQL_IN_CHUNK_SIZE):
+            chunk = missing[start : start + SQL_IN_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT {', '.join(IMAGE_COLUMNS)} FROM image_hashes "
+                f"WHERE sha256 IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            for row in rows:
+                found[row["sha256"]] = ImageRecord(**dict(row))
+
+        for sha256 in missing:
+            self._image_cache[sha256] = found.get(sha256)
+        return found
+
+    def get_image_by_original(self, original_url: str) -> Optional[ImageRecord]:
+        """Найти изображение по исходному URL на сайте."""
+        if original_url in self._image_by_original_cache:
+            self._image_by_original_cache.move_to_end(original_url)
+            return self._image_by_original_cache[original_url]
+        row = self._conn.execute(
+            f"SELECT {', '.join(IMAGE_COLUMNS)} FROM image_hashes "
+            "WHERE original_url = ? AND direct_url IS NOT NULL "
+            "ORDER BY updated_at DESC LIMIT 1",
+            (original_url,),
+        ).fetchone()
+        record = ImageRecord(**dict(row)) if row else None
+        self._remember_original(original_url, record)
+        return record
+
+    def get_images_by_originals(
+        self, original_urls: Iterable[str]
+    ) -> Dict[str, ImageRecord]:
+        """Найти изображения для набора исходных URL за минимум запросов."""
+        found: Dict[str, ImageRecord] = {}
+        missing: List[str] = []
+        for url in dict.fromkeys(original_urls):
+            if url in self._image_by_original_cache:
+                self._image_by_original_cache.move_to_end(url)
+                record = self._image_by_original_cache[url]
+                if record is not None:
+                    found[url] = record
+            else:
+                missing.append(url)
+
+        for start in range(0, len(missing), SQL_IN_CHUNK_SIZE):
+            chunk = missing[start : start + SQL_IN_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT {', '.join(IMAGE_COLUMNS)} FROM image_hashes "
+                f"WHERE original_url IN ({placeholders}) AND direct_url IS NOT NULL "
+                "ORDER BY updated_at",
+                chunk,
+            ).fetchall()
+            # Сортировка по возрастанию: более свежая запись перезапишет старую.
+            for row in rows:
+                found[row["original_url"]] = ImageRecord(**dict(row))
+
+        for url in missing:
+            self._remember_original(url, found.get(url))
+        return found
+
+    def save_image(
+        self,
+        sha256: str,
+        direct_url: Optional[str],
+        viewer_url: Optional[str],
+        thumb_url: Optional[str],
+        original_url: Optional[str],
+    ) -> None:
+        """Сохранить или обновить сведения об изображении."""
+        record = ImageRecord(
+            sha256=sha256,
+            direct_url=direct_url,
+            viewer_url=viewer_url,
+            thumb_url=thumb_url,
+            original_url=original_url,
+            updated_at=_utc_now(),
+        )
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO image_hashes (
+                    sha256, direct_url, viewer_url, thumb_url, original_url, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET
+                    direct_url = excluded.direct_url,
+                    viewer_url = excluded.viewer_url,
+                    thumb_url = excluded.thumb_url,
+                    original_url = excluded.original_url,
+                    updated_at = excluded.updated_at
+                """,
+                (
+                    record.sha256,
+                    record.direct_url,
+                    record.viewer_url,
+                    record.thumb_url,
+                    record.original_url,
+                    record.updated_at,
+                ),
+            )
+        self._image_cache[sha256] = record
+        if original_url:
+            self._remember_original(original_url, record if direct_url else None)
+
+    def _remember_original(
+        self, original_url: str, record: Optional[ImageRecord]
+    ) -> None:
+        self._image_by_original_cache[original_url] = record
+        self._image_by_original_cache.move_to_end(original_url)
+        if len(self._image_by_original_cache) > IMAGE_URL_CACHE_SIZE:
+            self._image_by_original_cache.popitem(last=False)
+
+    def close(self) -> None:
+        """Сбросить отложенные записи и закрыть соединение."""
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+
+    def _init_schema(self) -> None:
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS visited_urls (
+                    product_url TEXT PRIMARY KEY,
+                    product_id TEXT,
+                    etag_hash TEXT,
+                    image_sha256 TEXT,
+                    updated_at TEXT
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS image_hashes (
+                    sha256 TEXT PRIMARY KEY,
+                    direct_url TEXT,
+                    viewer_url TEXT,
+                    thumb_url TEXT,
+                    original_url TEXT,
+                    updated_at TEXT
+                )
+                """
+            )
+            # Миграция старой схемы (drive_file_id / public_url) до создания индексов.
+            self._migrate_image_hashes()
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_image_hashes_original_url "
+                "ON image_hashes (original_url)"
+            )
+
+    def _migrate_image_hashes(self) -> None:
+        columns = {
+            row["name"]
+            for row in self._conn.execute("PRAGMA table_info(image_hashes)")
+        }
+        for column in IMAGE_COLUMNS[1:]:
+            if column not in columns:
+                self._conn.execute(
+                    f"ALTER TABLE image_hashes ADD COLUMN {column} TEXT"
+                )
+                LOGGER.info("State: в image_hashes добавлена колонка %s", column)
+        if "public_url" in columns:
+            self._conn.execute(
+                "UPDATE image_hashes SET direct_url = public_url "
+                "WHERE direct_url IS NULL AND public_url IS NOT NULL"
+            )
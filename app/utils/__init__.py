@@ -6,16 +6,20 @@ from .text import (
     extract_abv_percent,
     extract_float_with_unit,
     extract_price_value,
+    extract_volume_and_abv,
     normalize_whitespace,
     split_multiline,
 )
+from .throttle import RequestThrottle
 
 __all__ = [
     "clean_text",
     "extract_abv_percent",
     "extract_float_with_unit",
     "extract_price_value",
+    "extract_volume_and_abv",
     "normalize_whitespace",
     "split_multiline",
     "product_etag",
+    "RequestThrottle",
 ]
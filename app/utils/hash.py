@@ -3,36 +3,49 @@
 from __future__ import annotations
 
 import hashlib
-import json
-from typing import Any, Dict
+from operator import attrgetter
+
+import orjson
 
 from app.models import ProductNormalized
 
+# Ключ в etag → атрибут ProductNormalized. Ключи отсортированы заранее, поэтому
+# словарь собирается сразу в каноническом порядке и OPT_SORT_KEYS не нужен.
+ETAG_FIELDS = dict(
+    sorted(
+        {
+            "product_url": "product_url",
+            "product_id": "product_id",
+            "title": "title",
+            "price_value": "price_value",
+            "price_currency": "price_currency",
+            "country": "country",
+            "volume_l": "volume_l",
+            "abv_percent": "abv_percent",
+            "availability": "availability",
+            "age_years": "age_years",
+            "brand": "brand",
+            "producer": "producer",
+            "sku": "sku",
+            "tasting_notes": "tasting_notes",
+            "gastronomy": "gastronomy",
+            "grapes": "grapes",
+            "maturation": "maturation",
+            "awards": "awards",
+            "gift_packaging": "gift_packaging",
+            "breadcrumbs": "breadcrumbs",
+            "image_url": "hero_image_url",
+        }.items()
+    )
+)
+_ETAG_KEYS = tuple(ETAG_FIELDS)
+_ETAG_VALUES = attrgetter(*ETAG_FIELDS.values())
+
 
 def product_etag(product: ProductNormalized) -> str:
     """Вычислить контрольную сумму карточки по основным полям."""
-    payload: Dict[str, Any] = {
-        "product_url": product.product_url,
-        "product_id": product.product_id,
-        "title": product.title,
-        "price_value": product.price_value,
-        "price_currency": product.price_currency,
-        "country": product.country,
-        "volume_l": product.volume_l,
-        "abv_percent": product.abv_percent,
-        "availability": product.availability,
-        "age_years": product.age_years,
-        "brand": product.brand,
-        "producer": product.producer,
-        "sku": product.sku,
-        "tasting_notes": product.tasting_notes,
-        "gastronomy": product.gastronomy,
-        "grapes": product.grapes,
-        "maturation": product.maturation,
-        "awards": product.awards,
-        "gift_packaging": product.gift_packaging,
-        "breadcrumbs": product.breadcrumbs,
-        "image_url": product.hero_image_url,
-    }
-    serialized = json.dumps(payload, ensure_ascii=False, sort_keys=True)
-    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+    payload = dict(zip(_ETAG_KEYS, _ETAG_VALUES(product)))
+    # orjson сразу отдаёт UTF-8 байты — без промежуточной строки и encode.
+    serialized = orjson.dumps(payload)
+    # Etag — не криптография: usedforsecurity=False снимает FIPS-ограничения OpenSSL.
+    return hashlib.sha256(serialized, usedforsecurity=False).hexdigest()
@@ -3,20 +3,40 @@
 from __future__ import annotations
 
 import re
-from typing import Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 WHITESPACE_RE = re.compile(r"\s+")
 VOLUME_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*л", re.IGNORECASE)
 ABV_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*%")
 PRICE_RE = re.compile(r"(\d[\d\s\u00a0]*)")
+MULTILINE_SPLIT_RE = re.compile(r"[\n;,]")
+# Объём и крепость одной альтернацией: один проход по тексту факта вместо двух.
+FACTS_RE = re.compile(
+    r"(?P<volume>\d+(?:[.,]\d+)?)\s*л|(?P<abv>\d+(?:[.,]\d+)?)\s*%",
+    re.IGNORECASE,
+)
+
+# Таблицы str.translate: один проход по строке вместо цепочки replace.
+# Разделители разрядов в ценах: пробел, NBSP, узкий NBSP и тонкая шпация.
+PRICE_SEPARATORS_TABLE = str.maketrans("", "", " \u00a0\u202f\u2009")
+MULTILINE_TABLE = str.maketrans({"\r": "\n", "\u00a0": " "})
+DECIMAL_COMMA_TABLE = str.maketrans(",", ".")
 
 
 def normalize_whitespace(value: str) -> str:
     """Свести все пробельные символы к одиночному пробелу."""
-    value = value.replace("\u00a0", " ")
+    # `\s` в str-шаблонах уже включает NBSP, отдельная замена не нужна.
     return WHITESPACE_RE.sub(" ", value).strip()
 
 
+def _to_float(number: str) -> Optional[float]:
+    """Преобразовать число с запятой или точкой в float."""
+    try:
+        return float(number.translate(DECIMAL_COMMA_TABLE))
+    except ValueError:
+        return None
+
+
 def clean_text(value: Optional[str]) -> Optional[str]:
     """Нормализовать текст и вернуть None для пустых значений."""
     if value is None:
@@ -32,11 +52,7 @@ def extract_float_with_unit(value: Optional[str]) -> Optional[float]:
     match = VOLUME_RE.search(value)
     if not match:
         return None
-    number = match.group(1).replace(",", ".")
-    try:
-        return float(number)
-    except ValueError:
-        return None
+    return _to_float(match.group(1))
 
 
 def extract_abv_percent(value: Optional[str]) -> Optional[float]:
@@ -46,11 +62,32 @@ def extract_abv_percent(value: Optional[str]) -> Optional[float]:
     match = ABV_RE.search(value)
     if not match:
         return None
-    number = match.group(1).replace(",", ".")
-    try:
-        return float(number)
-    except ValueError:
-        return None
+    return _to_float(match.group(1))
+
+
+def extract_volume_and_abv(
+    texts: Iterable[Optional[str]],
+) -> Tuple[Optional[str], Optional[float], Optional[str], Optional[float]]:
+    """Найти за один проход первый факт с объёмом и первый с крепостью.
+
+    Возвращает `(volume_text, volume_l, abv_text, abv_percent)`.
+    """
+    found: Dict[str, Tuple[str, float]] = {}
+    for text in texts:
+        if not text:
+            continue
+        for match in FACTS_RE.finditer(text):
+            name = match.lastgroup
+            if name is None or name in found:
+                continue
+            value = _to_float(match.group(name))
+            if value is not None:
+                found[name] = (text, value)
+        if len(found) == 2:
+            break
+    volume_text, volume_l = found.get("volume", (None, None))
+    abv_text, abv_percent = found.get("abv", (None, None))
+    return volume_text, volume_l, abv_text, abv_percent
 
 
 def extract_price_value(value: Optional[str]) -> Optional[float]:
@@ -60,7 +97,7 @@ def extract_price_value(value: Optional[str]) -> Optional[float]:
     match = PRICE_RE.search(value)
     if not match:
         return None
-    digits = match.group(1).replace(" ", "").replace("\u00a0", "")
+    digits = match.group(1).translate(PRICE_SEPARATORS_TABLE)
     try:
         return float(digits)
     except ValueError:
@@ -71,9 +108,9 @@ def split_multiline(value: Optional[str]) -> List[str]:
     """Разбить строку по переводам строки/разделителям на список значений."""
     if not value:
         return []
-    normalized = value.replace("\r", "\n").replace("\u00a0", " ")
+    normalized = value.translate(MULTILINE_TABLE)
     parts: Iterable[str] = (
         piece.strip()
-        for piece in re.split(r"[\n;,]", normalized)
+        for piece in MULTILINE_SPLIT_RE.split(normalized)
     )
     return [part for part in parts if part]
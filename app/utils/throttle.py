@@ -0,0 +1,25 @@
+"""Ограничение частоты запросов к сайту."""
+
+from __future__ import annotations
+
+import asyncio
+
+
+class RequestThrottle:
+    """Выдерживает минимальный интервал между запросами, общий для всех компонентов."""
+
+    def __init__(self, delay_seconds: float) -> None:
+        self._delay = delay_seconds
+        self._lock = asyncio.Lock()
+        self._last_request_at = 0.0
+
+    async def wait(self) -> None:
+        """Дождаться своей очереди: спим только остаток интервала с прошлого запроса."""
+        if self._delay <= 0:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            remaining = self._delay - (loop.time() - self._last_request_at)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            self._last_request_at = loop.time()
@@ -0,0 +1,115 @@
+"""Тесты пакетной обработки изображений MediaUploader."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import httpx
+
+from app.config import Settings
+from app.media import MediaUploader
+from app.state import StateRepository
+
+
+def _freeimage_handler(request: httpx.Request) -> httpx.Response:
+    if request.method == "POST":
+        return httpx.Response(
+            200,
+            json={
+                "success": {"code": 200},
+                "image": {
+                    "url": "https://iili.io/a.jpg",
+                    "url_viewer": "https://freeimage.host/i/a",
+                    "thumb": {"url": "https://iili.io/a.th.jpg"},
+                },
+            },
+        )
+    return httpx.Response(200, content=b"image-bytes")
+
+
+def _build_uploader(state: StateRepository) -> MediaUploader:
+    settings = Settings(FREEIMAGE_API_KEY="key", FREEIMAGE_MAX_RETRIES=0)
+    return MediaUploader(settings, state)
+
+
+async def _use_mock_transport(uploader: MediaUploader) -> None:
+    await uploader._http_client.aclose()
+    uploader._http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(_freeimage_handler)
+    )
+
+
+def test_ensure_images_logs_batch_summary(tmp_path, caplog) -> None:
+    state = StateRepository(tmp_path / "state.db")
+    uploader = _build_uploader(state)
+    image_urls = ("https://origin/a.jpg", "https://origin/a.jpg", "ftp://origin/b")
+    products = [
+        SimpleNamespace(product_url=f"https://shop/{index}", hero_image_url=url)
+        for index, url in enumerate(image_urls)
+    ]
+
+    async def scenario():
+        await _use_mock_transport(uploader)
+        try:
+            return await uploader.ensure_images(products)  # type: ignore[arg-type]
+        finally:
+            await uploader.aclose()
+
+    with caplog.at_level(logging.INFO, logger="app.media.service"):
+        results = asyncio.run(scenario())
+    state.close()
+
+    assert [result.direct_url for result in results] == [
+        "https://iili.io/a.jpg",
+        "https://iili.io/a.jpg",
+        None,
+    ]
+    info_messages = [
+        record.getMessage()
+        for record in caplog.records
+        if record.levelno == logging.INFO
+    ]
+    assert info_messages == [
+        "Изображения пачки обработаны: всего 3, загружено 1, из кеша 1, "
+        "без изображения 1"
+    ]
+
+
+def test_background_hash_backfills_saved_product(tmp_path) -> None:
+    state = StateRepository(tmp_path / "state.db")
+    uploader = _build_uploader(state)
+    product = SimpleNamespace(
+        product_url="https://shop/a", hero_image_url="https://origin/a.jpg"
+    )
+
+    async def scenario() -> None:
+        product_saved = asyncio.Event()
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.method == "GET":
+                # Скачивание для хэша завершится только после сохранения карточки.
+                await product_saved.wait()
+            return _freeimage_handler(request)
+
+        await uploader._http_client.aclose()
+        uploader._http_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler)
+        )
+        (result,) = await uploader.ensure_images([product])  # type: ignore[list-item]
+        assert result.direct_url and result.sha256 is None
+        state.upsert_product(product.product_url, "A", "etag", None)
+        state.flush()
+        product_saved.set()
+        await uploader.aclose()
+
+    asyncio.run(scenario())
+    state.close()
+
+    reopened = StateRepository(tmp_path / "state.db")
+    record = reopened.get_product(product.product_url)
+    image = reopened.get_image_by_original(product.hero_image_url)
+    assert image is not None
+    assert record is not None and record.image_sha256 == image.sha256
+    reopened.close()
@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import asyncio
+from functools import lru_cache
 from pathlib import Path
 
 from app.config import Settings
@@ -11,6 +13,7 @@ from app.parser.service import ProductPageParser
 FIXTURES_DIR = Path(__file__).parent / "fixtures"
 
 
+@lru_cache(maxsize=None)
 def load_fixture(name: str) -> str:
     return (FIXTURES_DIR / name).read_text(encoding="utf-8")
 
@@ -45,3 +48,52 @@ def test_parse_html_extracts_core_fields() -> None:
 
     tasting_notes = product.sections["tasting_notes"].text
     assert "аромат ванили" in tasting_notes.lower()
+
+
+class FakePage:
+    """Вкладка Playwright без браузера: помнит только, закрыта ли она."""
+
+    def __init__(self) -> None:
+        self.closed = False
+
+    async def route(self, pattern, handler) -> None:
+        return None
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class FakeContext:
+    def __init__(self) -> None:
+        self.pages: list[FakePage] = []
+
+    async def new_page(self) -> FakePage:
+        page = FakePage()
+        self.pages.append(page)
+        return page
+
+
+def test_page_pool_wakes_waiter_after_unhealthy_release() -> None:
+    parser = ProductPageParser(Settings(MAX_CONCURRENCY=1))
+    context = FakeContext()
+
+    async def scenario() -> None:
+        page = await parser._acquire_page(context)  # type: ignore[arg-type]
+        waiter = asyncio.create_task(parser._acquire_page(context))  # type: ignore[arg-type]
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        await parser._release_page(page, healthy=False)  # type: ignore[arg-type]
+        replacement = await asyncio.wait_for(waiter, timeout=1)
+
+        assert page.closed
+        assert replacement is not page
+        await parser._release_page(replacement, healthy=True)
+        await parser.aclose()
+
+    asyncio.run(scenario())
+
+    assert len(context.pages) == 2
@@ -0,0 +1,204 @@
+"""Тесты пакетной записи в Google Sheets."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import gspread
+import pytest
+import requests
+
+from app.config import Settings
+from app.sheets import SheetsWriter
+from app.sheets.service import SHEET_COLUMNS, _grapes_json
+
+
+def _api_error() -> gspread.exceptions.APIError:
+    response = requests.Response()
+    response.status_code = 503
+    response._content = b'{"error": {"code": 503, "message": "unavailable"}}'
+    return gspread.exceptions.APIError(response)
+
+
+class FakeWorksheet:
+    """Минимальная замена gspread.Worksheet, считающая обращения к API."""
+
+    def __init__(self, urls: list[str]) -> None:
+        self.rows = [list(SHEET_COLUMNS)] + [[url] for url in urls]
+        self.calls: list[str] = []
+        self.updated_ranges: list[str] = []
+        self.fail_append = 0
+        self.fail_col_values = 0
+
+    def row_values(self, index: int) -> list[str]:
+        self.calls.append("row_values")
+        return self.rows[index - 1]
+
+    def col_values(self, index: int) -> list[str]:
+        self.calls.append("col_values")
+        if self.fail_col_values:
+            self.fail_col_values -= 1
+            raise _api_error()
+        return [row[index - 1] for row in self.rows]
+
+    def batch_update(self, data, value_input_option=None) -> None:
+        self.calls.append("batch_update")
+        self.updated_ranges.extend(item["range"] for item in data)
+
+    def append_rows(self, rows, value_input_option=None) -> dict:
+        self.calls.append("append_rows")
+        if self.fail_append:
+            self.fail_append -= 1
+            raise RuntimeError("Sheets API недоступен")
+        first_row = len(self.rows) + 1
+        self.rows.extend(rows)
+        last_row = len(self.rows)
+        return {"updates": {"updatedRange": f"Sheet1!A{first_row}:S{last_row}"}}
+
+
+def _build_writer(worksheet: FakeWorksheet, batch_size: int) -> SheetsWriter:
+    writer = SheetsWriter(Settings(), state=None, batch_size=batch_size)  # type: ignore[arg-type]
+    writer._enabled = True  # type: ignore[attr-defined]
+    writer._worksheet = worksheet  # type: ignore[attr-defined]
+    return writer
+
+
+def _record(writer: SheetsWriter, url: str):
+    return writer.build_record(
+        product_url=url,
+        position=1,
+        title="Title",
+        price_value=10.0,
+        country=None,
+        volume_l=0.7,
+        abv_percent=40.0,
+        age_years=None,
+        brand=None,
+        producer=None,
+        tasting_notes=None,
+        gastronomy=None,
+        grapes=[],
+        maturation=None,
+        gift_packaging=None,
+        image_direct_url=None,
+        status="new",
+    )
+
+
+def test_build_record_orders_values_by_sheet_columns() -> None:
+    writer = _build_writer(FakeWorksheet([]), batch_size=10)
+    row = dict(zip(SHEET_COLUMNS, _record(writer, "https://example.com/a").to_row()))
+
+    assert len(row) == len(SHEET_COLUMNS)
+    assert row["PRODUCT_URL"] == "https://example.com/a"
+    assert row["PRICE_VALUE"] == "10"
+    assert row["ABV_PERCENT"] == "40"
+    assert row["GRAPES_JSON"] == "[]"
+    assert row["STATUS"] == "new"
+
+
+def test_grapes_json_matches_json_dumps_format() -> None:
+    for grapes in ([], ["Мерло"], ["Каберне Совиньон", 'Шираз "old vines"', "a\\b"]):
+        assert _grapes_json(grapes) == json.dumps(grapes, ensure_ascii=False)
+
+
+def test_sheets_writer_flushes_records_in_one_batch() -> None:
+    worksheet = FakeWorksheet(["https://example.com/a"])
+    writer = _build_writer(worksheet, batch_size=10)
+
+    async def scenario() -> None:
+        for url in ("https://example.com/a", "https://example.com/b"):
+            assert await writer.upsert(_record(writer, url)) == "queued"
+        assert worksheet.calls == []
+        await writer.flush()
+
+    asyncio.run(scenario())
+
+    assert worksheet.calls.count("batch_update") == 1
+    assert worksheet.calls.count("append_rows") == 1
+    assert worksheet.updated_ranges == ["A2:S2"]
+    assert writer.metrics.rows_inserted == 1
+    assert writer.metrics.rows_updated == 1
+
+
+def test_sheets_writer_reuses_row_index_between_flushes() -> None:
+    worksheet = FakeWorksheet([])
+    writer = _build_writer(worksheet, batch_size=10)
+
+    async def scenario() -> None:
+        await writer.upsert(_record(writer, "https://example.com/new"))
+        await writer.flush()
+        await writer.upsert(_record(writer, "https://example.com/new"))
+        await writer.flush()
+
+    asyncio.run(scenario())
+
+    assert worksheet.calls.count("row_values") == 1
+    assert worksheet.calls.count("col_values") == 1
+    assert worksheet.updated_ranges == ["A2:S2"]
+    assert writer.metrics.rows_inserted == 1
+    assert writer.metrics.rows_updated == 1
+
+
+def test_sheets_writer_keeps_records_when_flush_fails() -> None:
+    worksheet = FakeWorksheet([])
+    worksheet.fail_append = 1
+    writer = _build_writer(worksheet, batch_size=10)
+    url = "https://example.com/new"
+
+    async def scenario() -> None:
+        await writer.upsert(_record(writer, url))
+        with pytest.raises(RuntimeError):
+            await writer.flush()
+        assert writer.has_pending(url)
+        await writer.flush()
+
+    asyncio.run(scenario())
+
+    assert not writer.has_pending(url)
+    assert worksheet.calls.count("append_rows") == 2
+    assert worksheet.rows[-1][0] == url
+    assert writer.metrics.rows_inserted == 1
+
+
+def test_sheets_writer_rereads_row_index_after_api_error() -> None:
+    url = "https://example.com/a"
+    worksheet = FakeWorksheet([url])
+    worksheet.fail_col_values = 1
+    writer = _build_writer(worksheet, batch_size=10)
+
+    async def scenario() -> None:
+        await writer.upsert(_record(writer, url))
+        with pytest.raises(gspread.exceptions.APIError):
+            await writer.flush()
+        await writer.flush()
+
+    asyncio.run(scenario())
+
+    assert worksheet.calls.count("col_values") == 2
+    assert "append_rows" not in worksheet.calls
+    assert worksheet.updated_ranges == ["A2:S2"]
+    assert writer.metrics.rows_updated == 1
+
+
+def test_sheets_writer_updates_first_row_for_duplicate_urls() -> None:
+    url = "https://example.com/a"
+    worksheet = FakeWorksheet([url, "https://example.com/b", url])
+    writer = _build_writer(worksheet, batch_size=10)
+
+    async def scenario() -> None:
+        await writer.upsert(_record(writer, url))
+        await writer.flush()
+
+    asyncio.run(scenario())
+
+    assert worksheet.updated_ranges == ["A2:S2"]
+
+
+def test_get_last_position_ignores_non_numeric_cells() -> None:
+    worksheet = FakeWorksheet([])
+    worksheet.rows.extend([["a", "7"], ["b", ""], ["c", "n/a"], ["d", "12"]])
+    writer = _build_writer(worksheet, batch_size=10)
+
+    assert asyncio.run(writer.get_last_position()) == 12
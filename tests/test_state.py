@@ -80,3 +80,58 @@ def test_state_repository_migrates_legacy_schema(tmp_path) -> None:
     assert record is not None
     assert record.direct_url == "https://cdn.direct/legacy"
     repo.close()
+
+
+def test_state_repository_batches_product_writes(tmp_path) -> None:
+    db_path = tmp_path / "batched.db"
+    repo = StateRepository(db_path, batch_size=10)
+
+    repo.upsert_product("https://example.com/a", "A", "etag-a", None)
+    assert repo.get_product("https://example.com/a").etag_hash == "etag-a"
+
+    conn = sqlite3.connect(db_path)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM visited_urls").fetchone()[0]
+    finally:
+        conn.close()
+    assert count == 0
+
+    repo.close()
+
+    reopened = StateRepository(db_path)
+    record = reopened.get_product("https://example.com/a")
+    assert record is not None
+    assert record.product_id == "A"
+    reopened.close()
+
+
+def test_state_repository_bulk_lookup_by_originals(tmp_path) -> None:
+    repo = StateRepository(tmp_path / "bulk.db")
+    repo.save_image("sha-a", "https://img/a", None, None, "https://origin/a")
+    repo.save_image("sha-b", None, None, None, "https://origin/b")
+
+    fresh = StateRepository(tmp_path / "bulk.db")
+    found = fresh.get_images_by_originals(
+        ["https://origin/a", "https://origin/b", "https://origin/missing"]
+    )
+    assert set(found) == {"https://origin/a"}
+    assert found["https://origin/a"].direct_url == "https://img/a"
+    assert fresh.get_image_by_original("https://origin/missing") is None
+
+    fresh.close()
+    repo.close()
+
+
+def test_state_repository_bulk_lookup_by_sha(tmp_path) -> None:
+    repo = StateRepository(tmp_path / "bulk.db")
+    repo.save_image("sha-a", "https://img/a", None, None, "https://origin/a")
+    repo.save_image("sha-b", "https://img/b", None, None, "https://origin/b")
+
+    fresh = StateRepository(tmp_path / "bulk.db")
+    found = fresh.get_images(["sha-a", "sha-b", "sha-a", "sha-missing"])
+    assert set(found) == {"sha-a", "sha-b"}
+    assert found["sha-b"].direct_url == "https://img/b"
+    assert fresh.get_image("sha-missing") is None
+
+    fresh.close()
+    repo.close()
@@ -0,0 +1,32 @@
+"""Тесты текстовых помощников."""
+
+from __future__ import annotations
+
+from app.utils import extract_volume_and_abv
+
+
+def test_extract_volume_and_abv_skips_facts_without_number() -> None:
+    facts = ["Объём бутылки уточняйте у менеджера", "0.7 л", "40 %"]
+
+    assert extract_volume_and_abv(facts) == ("0.7 л", 0.7, "40 %", 40.0)
+
+
+def test_extract_volume_and_abv_parses_decimal_comma() -> None:
+    facts = [None, "Объём 0,75 л", "Крепость 12,5 %"]
+
+    assert extract_volume_and_abv(facts) == (
+        "Объём 0,75 л",
+        0.75,
+        "Крепость 12,5 %",
+        12.5,
+    )
+
+
+def test_extract_volume_and_abv_reads_both_from_one_fact() -> None:
+    fact = "0,5 Л / 43 %"
+
+    assert extract_volume_and_abv([fact, "1 л", "40 %"]) == (fact, 0.5, fact, 43.0)
+
+
+def test_extract_volume_and_abv_returns_none_when_missing() -> None:
+    assert extract_volume_and_abv(["Франция", ""]) == (None, None, None, None)
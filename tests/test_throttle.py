@@ -0,0 +1,50 @@
+"""Тесты общего ограничителя частоты запросов."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from app.utils import RequestThrottle
+
+
+def _record_sleeps(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    sleeps: list[float] = []
+
+    async def fake_sleep(delay: float) -> None:
+        sleeps.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    return sleeps
+
+
+def test_throttle_sleeps_only_remaining_interval(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sleeps = _record_sleeps(monkeypatch)
+    throttle = RequestThrottle(1.0)
+
+    async def scenario() -> None:
+        await throttle.wait()
+        # С прошлого запроса прошло 0.4 с — ждать нужно только остаток.
+        throttle._last_request_at = asyncio.get_running_loop().time() - 0.4
+        await throttle.wait()
+
+    asyncio.run(scenario())
+
+    assert len(sleeps) == 1
+    assert sleeps[0] == pytest.approx(0.6, abs=0.05)
+
+
+def test_throttle_without_delay_never_sleeps(monkeypatch: pytest.MonkeyPatch) -> None:
+    sleeps = _record_sleeps(monkeypatch)
+    throttle = RequestThrottle(0)
+
+    async def scenario() -> None:
+        for _ in range(3):
+            await throttle.wait()
+
+    asyncio.run(scenario())
+
+    assert sleeps == []